@@ -4,20 +4,23 @@
 # All rights reserved
 
 import cv2
-import colorsys
 import numpy as np
-import tensorflow as tf
-from pathlib import Path
-from os import path, makedirs
-import matplotlib.pyplot as plt
+import threading
+from os import cpu_count
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from warnings import simplefilter
-from PIL import Image, ImageEnhance
-import imquality.brisque as brisque
-from tensorflow.python.ops.numpy_ops import np_config
+
+# Note: heavy optional dependencies (PIL, imquality, scipy) are imported lazily by the
+#       functions which need them, so importing this module stays fast and light
 
 # ignore all future warnings
 simplefilter(action='ignore', category=FutureWarning)
 
+# CLAHE engines cache, per thread (cv2.CLAHE objects are not thread safe):
+clahe_cache = threading.local()
+clahe_cache_size = 16
+
 # -----------------------------------------------------------------------
 
 def histeq(img):
@@ -40,11 +43,29 @@ def histeq(img):
 
 # -----------------------------------------------------------------------
 
-def clahe(img, grid_size=8):
+def clahe_engine(clip_limit=2.0, grid_size=8):
+  """ Returns a cv2.CLAHE object for (clip_limit, grid_size), cached per thread """
+
+  engines = getattr(clahe_cache, 'engines', None)
+  if engines is None:
+    engines = clahe_cache.engines = {}
+
+  key = (float(clip_limit), int(grid_size))
+  engine = engines.get(key)
+  if engine is None:
+    if len(engines) >= clahe_cache_size:
+      engines.pop(next(iter(engines)))
+    engine = engines[key] = cv2.createCLAHE(clipLimit=key[0], tileGridSize=(key[1],key[1]))
+
+  return engine
+
+# -----------------------------------------------------------------------
+
+def clahe(img, grid_size=8, clip_limit=2.0):
   """ Apply CLAHE to the converted image in LAB format to
       only Lightness component and convert back the image to RGB """
 
-  clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(grid_size,grid_size))
+  clahe = clahe_engine(clip_limit, grid_size)
 
   # Color input:
   if len(img.shape) == 3:
@@ -62,21 +83,214 @@ def clahe(img, grid_size=8):
 
 # -----------------------------------------------------------------------
 
-def gamma_correction(img, gamma=0.001):
-  """ Apply Gamma Correction, so that Out = MaxVal*(In/MaxVal)**(1/gamma)"""
+def histeq_clahe(img, grid_size=8, clip_limit=2.0, dst=None, lab=None, l_plane=None, sharpen=None):
+  """ Fused Histogram Equalization + CLAHE, applied back-to-back on the Lightness component
+      of a single LAB conversion (equivalent to clahe(histeq(img)) with one color round trip).
+      With sharpen (sharpening keyword arguments), the Lightness is sharpened as well, a third of a BGR sharpening work.
+      lab and l_plane are optional preallocated scratch buffers (see histeq_clahe16 for uint16 images) """
+
+  if img.dtype == np.uint16:
+    return histeq_clahe16(img, grid_size, clip_limit, dst, lab, l_plane, sharpen)
+
+  clahe = clahe_engine(clip_limit, grid_size)
+
+  # Color input:
+  if len(img.shape) == 3:
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=lab)
+    l_plane = cv2.extractChannel(lab, 0, dst=l_plane)
+    cv2.equalizeHist(l_plane, dst=l_plane)
+    clahe.apply(l_plane, dst=l_plane)
+    if sharpen is not None:
+      l_plane = sharpening(l_plane, **sharpen)
+    cv2.insertChannel(l_plane, lab, 0)
+    res = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=lab if dst is None else dst)
+
+  # Gray input:
+  else:
+    res = cv2.equalizeHist(img.astype(np.uint8), dst=dst)
+    clahe.apply(res, dst=res)
+    if sharpen is not None:
+      np.copyto(res, sharpening(res, **sharpen))
+
+  return res
+
+# -----------------------------------------------------------------------
+
+def equalize_hist16(img, dst=None):
+  """ cv2.equalizeHist counterpart for a single channel uint16 image (same mapping, over 65536 levels) """
+
+  hist = np.bincount(img.ravel(), minlength=65536)
+  first = np.flatnonzero(hist)[0]
+
+  if hist[first] == img.size:
+    table = np.full(65536, first, np.uint16)
+  else:
+    cdf = np.cumsum(hist)
+    table = np.clip(np.rint((cdf - cdf[first]) * (65535. / (img.size - hist[first]))), 0, 65535).astype(np.uint16)
+
+  return lut16(img, table, dst)
+
+def histeq_clahe16(img, grid_size=8, clip_limit=2.0, dst=None, lab=None, l_plane=None, sharpen=None):
+  """ histeq_clahe of a uint16 image: a float32 LAB conversion, whose Lightness is equalized as uint16 (0-100 --> 0-65535).
+      CLAHE runs as an 8-bit residual (see residual_8bit), since OpenCV's uint16 CLAHE spreads the clip limit over 65536
+      bins, which makes it ineffective, so clip_limit has its 8-bit meaning.
+      lab (float32, image shape) and l_plane (uint16, single channel) are optional preallocated scratch buffers """
+
+  clahe = clahe_engine(clip_limit, grid_size)
+
+  # Gray input:
+  if len(img.shape) == 2:
+    res = equalize_hist16(img, dst)
+    residual_8bit(clahe.apply, res, dst=res)
+    if sharpen is not None:
+      np.copyto(res, sharpening(res, **sharpen))
+    return res
+
+  lab = np.multiply(img, np.float32(1 / 65535.), out=lab, dtype=np.float32)
+  cv2.cvtColor(lab, cv2.COLOR_BGR2LAB, dst=lab)
+
+  lightness = lab[:,:,0]
+  lightness *= 655.35
+  lightness += 0.5
+  l_plane = np.empty(img.shape[:2], np.uint16) if l_plane is None else l_plane
+  np.copyto(l_plane, lightness, casting='unsafe')
+
+  equalize_hist16(l_plane, dst=l_plane)
+  residual_8bit(clahe.apply, l_plane, dst=l_plane)
+  if sharpen is not None:
+    l_plane = sharpening(l_plane, **sharpen)
+
+  np.multiply(l_plane, np.float32(1 / 655.35), out=lightness)
+  cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=lab)
+
+  lab *= 65535.
+  lab += 0.5
+  np.clip(lab, 0, 65535, out=lab)
+  res = np.empty(img.shape, np.uint16) if dst is None else dst
+  np.copyto(res, lab, casting='unsafe')
+
+  return res
+
+# -----------------------------------------------------------------------
+
+# Bayer patterns (OpenCV naming) --> (row, column) of the red and the blue pixels within every 2x2 cell, the other two being green:
+bayer_cells = {'BG': ((0, 0), (1, 1)), 'GB': ((0, 1), (1, 0)), 'RG': ((1, 1), (0, 0)), 'GR': ((1, 0), (0, 1))}
+
+# Demosaic algorithms --> OpenCV conversion code suffix (None: half resolution binning, see demosaic_binning):
+demosaic_algorithms = {'bilinear': '', 'vng': '_VNG', 'ea': '_EA', 'binning': None}
+
+def demosaic_shape(shape, algorithm='bilinear'):
+  """ BGR frame shape of a demosaiced (height, width) raw frame """
+
+  if algorithm == 'binning':
+    return (shape[0] // 2, shape[1] // 2, 3)
+
+  return (shape[0], shape[1], 3)
+
+def demosaic_binning(bayer, pattern='BG', dst=None):
+  """ Half resolution demosaic: every 2x2 Bayer cell becomes a single BGR pixel (its two greens averaged),
+      i.e. a quarter size frame, with no interpolation at all. An odd last row/column is dropped """
+
+  (ry, rx), (by, bx) = bayer_cells[pattern]
+  height, width = demosaic_shape(bayer.shape, 'binning')[:2]
+  cells = bayer[:2*height,:2*width]
+
+  res = np.empty((height, width, 3), bayer.dtype) if dst is None else dst
+  res[:,:,0] = cells[by::2,bx::2]
+  res[:,:,2] = cells[ry::2,rx::2]
+  green = np.add(cells[ry::2,1-rx::2], cells[1-ry::2,rx::2], dtype=np.uint32)
+  green += 1
+  green >>= 1
+  res[:,:,1] = green
+
+  return res
+
+def demosaic(bayer, pattern='BG', algorithm='bilinear', dst=None):
+  """ Raw (Bayer) frame --> BGR frame, pattern being one of bayer_cells and algorithm one of demosaic_algorithms:
+      bilinear, vng (Variable Number of Gradients, 8-bit only), ea (edge-aware) or binning (half resolution) """
+
+  if pattern not in bayer_cells or algorithm not in demosaic_algorithms:
+    raise ValueError('Unsupported demosaic: pattern %s, algorithm %s' % (pattern, algorithm))
+
+  if algorithm == 'binning':
+    return demosaic_binning(bayer, pattern, dst)
+
+  if algorithm == 'vng' and bayer.dtype != np.uint8:
+    raise ValueError('VNG demosaic supports 8-bit frames only')
+
+  code = getattr(cv2, 'COLOR_BAYER_%s2BGR%s' % (pattern, demosaic_algorithms[algorithm]))
+
+  return cv2.cvtColor(np.ascontiguousarray(bayer), code, dst=dst)
+
+# -----------------------------------------------------------------------
+
+@lru_cache(maxsize=32)
+def gamma_table(dtype, gamma):
+  """ Gamma Correction lookup table for an unsigned integer dtype, cached per (dtype, gamma).
+      8-bit:  Out = MaxVal*(In/MaxVal)**(1/gamma)
+      16-bit: Out = MaxVal*(In/MaxVal)**gamma (former tf.image.adjust_gamma semantics) """
+
+  dtype = np.dtype(dtype)
+  max_val = np.iinfo(dtype).max
+
+  # Scalar (libm) pow, as the former per-level table, so truncation matches it exactly whatever NumPy's vectorized
+  # np.power rounding is (which differs by one ulp for some levels on some NumPy versions):
+  exponent = 1 / gamma if dtype == np.uint8 else gamma
+  table = np.array([pow(k / max_val, exponent) for k in range(max_val+1)]) * max_val
+
+  table = np.clip(table, 0, max_val).astype(dtype)
+  table.flags.writeable = False
+
+  return table
+
+# -----------------------------------------------------------------------
+
+def lut16(img, table, dst=None):
+  """ Lookup table of a uint16 image """
+
+  # np.take converts the indices to intp, gather by blocks of ~64K pixels to keep that temporary small:
+  res = np.empty_like(img) if dst is None else dst
+  block = max(1, 2**16 // img[0].size)
+  for row in range(0, img.shape[0], block):
+    np.take(table, img[row:row+block], out=res[row:row+block], mode='clip')
 
-  max_val = np.iinfo(img.dtype).max
+  return res
+
+# -----------------------------------------------------------------------
 
-  invGamma = 1 / gamma
+def gamma_correction(img, gamma=0.001, dst=None):
+  """ Apply Gamma Correction by a (cached) lookup table, see gamma_table for the exact mapping """
 
-  table = [np.clip(pow(k/max_val, invGamma) * max_val, 0, max_val) for k in range(max_val+1)]
-  table = np.array(table, img.dtype)
+  table = gamma_table(img.dtype, gamma)
 
   if img.dtype == np.uint8:
-    res = cv2.LUT(img, table)
+    res = cv2.LUT(img, table, dst=dst)
 
   else:
-    res = tf.image.adjust_gamma(img/max_val, gamma=gamma, gain=max_val).numpy()
+    res = lut16(img, table, dst)
+
+  return res
+
+# -----------------------------------------------------------------------
+
+def colorize_bgr(img, hue, dst=None):
+  """ Colorize a BGR uint8 image with the given `hue` (hue within 0-360), keeping each pixel's saturation and value.
+      Since the hue is constant, HSV->RGB reduces to picking per-pixel max/min blends by a single hue sector """
+
+  h = hue / 360.
+  sector = int(h * 6.)
+  f = h * 6. - sector
+  sector %= 6
+
+  b, g, r = cv2.split(img)
+  v = cv2.max(cv2.max(b, g), r)
+  p = cv2.min(cv2.min(b, g), r)
+  q = cv2.addWeighted(v, 1. - f, p, f, 0)
+  t = cv2.addWeighted(p, 1. - f, v, f, 0)
+
+  r, g, b = [(v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)][sector]
+
+  res = cv2.merge((b, g, r), dst=dst)
 
   return res
 
@@ -85,110 +299,407 @@ def gamma_correction(img, gamma=0.001):
 def colorize(image, hue):
   """ Colorize PIL image `original` with the given `hue` (hue within 0-360), returns another PIL image """
 
-  def shift_hue(arr, hout):
-    rgb_to_hsv = np.vectorize(colorsys.rgb_to_hsv)
-    hsv_to_rgb = np.vectorize(colorsys.hsv_to_rgb)
+  from PIL import Image
 
-    r, g, b, a = np.rollaxis(arr, axis=-1)
-    h, s, v = rgb_to_hsv(r, g, b)
-    h = hout
-    r, g, b = hsv_to_rgb(h, s, v)
-    arr = np.dstack((r, g, b, a))
-    return arr
-
-  img = image.convert('RGBA')
-  arr = np.array(np.asarray(img).astype('float'))
-  res = Image.fromarray(shift_hue(arr, hue/360.).astype('uint8'), 'RGBA')
+  arr = np.array(image.convert('RGBA'))
+  arr[:,:,2::-1] = colorize_bgr(np.ascontiguousarray(arr[:,:,2::-1]), hue)
+  res = Image.fromarray(arr, 'RGBA')
 
   return res
 
 # -----------------------------------------------------------------------
 
-def saturation(img, saturation_factor=1.1):
-  """ Image Saturation, based on PIL library """
+@lru_cache(maxsize=32)
+def saturation_matrix(saturation_factor):
+  """ 3x3 BGR color matrix, so that Out = f*In + (1-f)*Luma, with ITU-R 601-2 luma (as PIL ImageEnhance.Color) """
+
+  luma = np.array([[0.114, 0.587, 0.299]])
+
+  matrix = saturation_factor * np.eye(3) + (1 - saturation_factor) * np.ones((3, 1)) @ luma
+  matrix.flags.writeable = False
+
+  return matrix
+
+# -----------------------------------------------------------------------
+
+def saturation(img, saturation_factor=1.1, dst=None):
+  """ Image Saturation on BGR uint8 data, a single fixed-point cv2.transform pass with no intermediate frames.
+      Pass dst=img for an in-place operation """
+
+  # Gray input:
+  if len(img.shape) == 2:
+    if dst is None:
+      return img.copy()
+    np.copyto(dst, img)
+    return dst
 
-  pil_img = Image.fromarray(img)
-  res = np.array(ImageEnhance.Color(pil_img).enhance(saturation_factor))
+  res = cv2.transform(img, saturation_matrix(float(saturation_factor)), dst=dst)
 
   return res
 
 # -----------------------------------------------------------------------
 
-def sharpening(img):
-  """ Image sharpening by a kernel operation """
+@lru_cache(maxsize=32)
+def sharpening_kernel(amount=1.0):
+  """ 3x3 sharpening kernel, identity + amount*(4-neighbors Laplacian), cached per amount (amount=1: the classic one) """
+
+  kernel = np.array([[0, -amount, 0],
+                     [-amount, 1 + 4*amount, -amount],
+                     [0, -amount, 0]], np.float32)
+  kernel.flags.writeable = False
+
+  return kernel
+
+def unsharp_mask(img, amount=1.0, radius=1.0, dst=None):
+  """ Unsharp masking: Out = (1+amount)*In - amount*GaussianBlur(In, sigma=radius), the blur being separable.
+      The blurred image is computed into dst, which must not be img """
 
-  kernel = np.array([[0, -1, 0],
-                     [-1, 5,-1],
-                     [0, -1, 0]])
+  blurred = cv2.GaussianBlur(img, (0, 0), radius, dst=dst)
 
-  res = cv2.filter2D(src=img, ddepth=-1, kernel=kernel)
+  return cv2.addWeighted(img, 1. + amount, blurred, -amount, 0., dst=blurred)
+
+def sharpening(img, dst=None, method='kernel', amount=1.0, radius=1.0):
+  """ Image sharpening, by the 3x3 sharpening_kernel (method='kernel', radius unused) or by unsharp_mask ('unsharp') """
+
+  if method == 'unsharp':
+    res = unsharp_mask(img, amount, radius, dst)
+
+  else:
+    res = cv2.filter2D(src=img, ddepth=-1, kernel=sharpening_kernel(float(amount)), dst=dst)
 
   return res
 
+def sharpening_kwargs(params):
+  """ sharpening keyword arguments of image_enhance params """
+
+  return {'method': params['sharpening_method'], 'amount': params['sharpening_amount'], 'radius': params['sharpening_radius']}
+
 # -----------------------------------------------------------------------
 
-def denoise(img, mode='bilateral', median_kernel=11, d=9, sigmaColor=75, sigmaSpace=75):
-  """ Applies the bilateral filter to an image, highly effective in noise removal while keeping edges sharp """
+def denoise(img, mode='bilateral', median_kernel=11, d=9, sigmaColor=75, sigmaSpace=75, dst=None):
+  """ Applies the bilateral filter to an image, highly effective in noise removal while keeping edges sharp
+      (uint16 images are filtered as 8-bit residuals, see residual_8bit) """
+
+  if img.dtype == np.uint16:
+    return residual_8bit(denoise, img, mode, median_kernel, d, sigmaColor, sigmaSpace, dst=dst)
 
   if mode == 'median':
-    res = cv2.medianBlur(img, median_kernel)
+    res = cv2.medianBlur(img, median_kernel, dst=dst)
 
   elif mode == 'bilateral':
-    res = cv2.bilateralFilter(img, d, sigmaColor, sigmaSpace)
+    res = cv2.bilateralFilter(img, d, sigmaColor, sigmaSpace, dst=dst)
 
-  else:
+  elif dst is None:
     res = img.copy()
 
+  else:
+    np.copyto(dst, img)
+    res = dst
+
   return res
 
 # -----------------------------------------------------------------------
 
-def nl_denoise(img, h=10, template_win=7, search_win=21, temporal_index=2, temporal_window=3):
+def nl_denoise_tiled(img, h=10, template_win=7, search_win=21, tile_size=512, workers=0, dst=None):
+  """ Non-local Means Denoising by overlapping tiles, processed on a thread pool (workers=0 --> cpu count).
+      Tiles overlap by the search + template windows radii, so every tile core sees exactly the neighborhood
+      it would see in the full frame, and cores are pasted with no visible seams """
+
+  rows, cols = img.shape[:2]
+  margin = search_win // 2 + template_win // 2
+
+  if dst is None:
+    dst = np.empty_like(img)
+
+  def denoise_tile(origin):
+    y, x = origin
+    y_end, x_end = min(y + tile_size, rows), min(x + tile_size, cols)
+    y0, x0 = max(y - margin, 0), max(x - margin, 0)
+    y1, x1 = min(y_end + margin, rows), min(x_end + margin, cols)
+    tile = cv2.fastNlMeansDenoisingColored(img[y0:y1, x0:x1], None, h, h, template_win, search_win)
+    dst[y:y_end, x:x_end] = tile[y-y0:y_end-y0, x-x0:x_end-x0]
+
+  origins = [(y, x) for y in range(0, rows, tile_size) for x in range(0, cols, tile_size)]
+  with ThreadPoolExecutor(max_workers=workers or cpu_count()) as executor:
+    list(executor.map(denoise_tile, origins))
+
+  return dst
+
+# -----------------------------------------------------------------------
+
+def nl_denoise(img, h=10, template_win=7, search_win=21, temporal_index=2, temporal_window=3, tile_size=0, workers=0, dst=None):
   """ Non-local Means Denoising algorithm to remove noise in the image
       If img is a list of images, then temporal information will be exploit.
       For example, if img is a list of 5 frames, and temporal_index=2 and
-      temopral_window=3 then frame-1, frame-2 and frame-3 are used to denoise frame-2 """
+      temopral_window=3 then frame-1, frame-2 and frame-3 are used to denoise frame-2
+      A single image is processed by tiles when tile_size > 0, see nl_denoise_tiled
+      uint16 images are denoised as 8-bit residuals, see residual_8bit """
+
+  if (img[0] if type(img) == list else img).dtype == np.uint16:
+    return residual_8bit(nl_denoise, img, h, template_win, search_win, temporal_index, temporal_window, tile_size, workers,
+                         index=temporal_index if type(img) == list else None, dst=dst)
 
   if type(img) == list:
-    res = cv2.fastNlMeansDenoisingColoredMulti(img, temporal_index, temporal_window, None, h, h, template_win, search_win)
+    res = cv2.fastNlMeansDenoisingColoredMulti(img, temporal_index, temporal_window, dst, h, h, template_win, search_win)
+
+  elif tile_size > 0:
+    res = nl_denoise_tiled(img, h, template_win, search_win, tile_size, workers, dst)
 
   else:
-    res = cv2.fastNlMeansDenoisingColored(img, None, h, h, template_win, search_win)
+    res = cv2.fastNlMeansDenoisingColored(img, dst, h, h, template_win, search_win)
 
   return res
 
 # -----------------------------------------------------------------------
 
-def iqa_score(img, resize=(380, 507)):
-  """ Image Quality Assessment with no-reference, return the BRISQUE score """
+def iqa_score(img, resize=(380, 507), native=True):
+  """ Image Quality Assessment with no-reference, return the BRISQUE score
+      native=True uses image_enhancement_brisque, else the (slower) imquality implementation """
 
   resized_img = cv2.resize(img, resize)
-  iqa_score = brisque.score(resized_img)
+
+  if native:
+    from image_enhancement_brisque import brisque_score
+    iqa_score = brisque_score(resized_img)
+
+  else:
+    import imquality.brisque as brisque
+    iqa_score = brisque.score(resized_img)
 
   return iqa_score
 
 # -----------------------------------------------------------------------
 
-def image_enhance(img, params):
-  """ Gamma Correction + Histogram Equalization + CLAHE + Local Denoise + Sharpening + NonLocal Denoise + Saturation """
+def iqa_score_batch(imgs, resize=(380, 507)):
+  """ Image Quality Assessment of many images at once, return their BRISQUE scores """
+
+  from image_enhancement_brisque import brisque_score_batch
+
+  return brisque_score_batch([cv2.resize(img, resize) for img in imgs])
+
+# -----------------------------------------------------------------------
+
+class BufferArena(object):
+  """ Reusable named frame buffers for image_enhance, (re)allocated only when a frame shape or dtype changes """
+
+  def __init__(self):
+    self.buffers = {}
+
+  def get(self, name, shape, dtype=np.uint8):
+    buf = self.buffers.get(name)
+    if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+      buf = self.buffers[name] = np.empty(shape, dtype)
+    return buf
+
+  def nbytes(self):
+    return sum(buf.nbytes for buf in self.buffers.values())
+
+# -----------------------------------------------------------------------
+
+def arena_helpers(arena, shape, dtype=np.uint8):
+  """ Returns (buf, swap) for a frame shape: buf(name, shape, dtype) gets an arena buffer, and swap(cur) gets
+      the one of the two arena frames (ping/pong, of dtype) which cur is not. Both return None without an arena """
+
+  buf = (lambda name, shape, dtype=np.uint8: None) if arena is None else arena.get
+
+  ping, pong = buf('ping', shape, dtype), buf('pong', shape, dtype)
+  swap = lambda cur: pong if cur is ping else ping
+
+  return buf, swap
+
+# -----------------------------------------------------------------------
+
+def to_uint8(img, dst=None):
+  """ Narrowing to uint8, as a plain astype (16-bit values wrap around), optionally into dst """
+
+  if dst is None:
+    return img.astype(np.uint8)
+
+  np.copyto(dst, img, casting='unsafe')
+
+  return dst
+
+# -----------------------------------------------------------------------
+
+def to_uint16(img, dst=None):
+  """ Widening of uint8 to uint16, full scale (x257). NumPy, since a scalar cv2.multiply operand only scales the
+      first channel with OpenCV 4.x (a Scalar(257,0,0,0)) """
+
+  return np.multiply(img, 257, out=dst, dtype=np.uint16)
+
+def to_bit_depth(img, bit_depth=8, dst=None):
+  """ Gamma corrected image --> image_enhance working depth: to_uint8 (8), or uint16 (16) kept or widened """
+
+  if img.dtype == (np.uint8 if bit_depth == 8 else np.uint16):
+    if dst is None:
+      return img
+    np.copyto(dst, img)
+    return dst
+
+  return to_uint8(img, dst) if bit_depth == 8 else to_uint16(img, dst)
+
+def quantize(img, dst=None):
+  """ Rounded rescaling of uint16 to uint8, the final quantization of the 16-bit mode (uint8 is passed through) """
+
+  if img.dtype == np.uint8:
+    if dst is None:
+      return img
+    np.copyto(dst, img)
+    return dst
+
+  return cv2.convertScaleAbs(img, dst, alpha=1 / 257.)
+
+def residual_8bit(func, img, *args, index=None, dst=None, **kwargs):
+  """ 8-bit only filter func(img8, *args, **kwargs) of a uint16 image (or list of images, index being the filtered one),
+      as a residual: img + 257*(func(img8) - img8), with img8 the quantized img. So only the change the filter makes
+      is quantized, the image precision is kept """
+
+  img8 = [quantize(frame) for frame in img] if index is not None else quantize(img)
+  frame, frame8 = (img[index], img8[index]) if index is not None else (img, img8)
+
+  change = cv2.subtract(func(img8, *args, **kwargs), frame8, dtype=cv2.CV_16S)
+
+  return cv2.addWeighted(frame, 1., change, 257., 0., dst=dst, dtype=cv2.CV_16U)
+
+# -----------------------------------------------------------------------
+
+def run_stage(profiler, stage, func, *args, **kwargs):
+  """ Runs a single image_enhance stage, through the profiler if given (see image_enhancement_profiler) """
+
+  if profiler is None:
+    return func(*args, **kwargs)
+
+  return profiler.run(stage, func, *args, **kwargs)
+
+# -----------------------------------------------------------------------
+
+def image_enhance_demosaic(img, params, arena=None, profiler=None):
+  """ image_enhance first stage: Demosaic of a raw (2D, Bayer) frame, a BGR frame is passed through """
+
+  if img.ndim == 3:
+    return img
+
+  dst = None if arena is None else arena.get('demosaic', demosaic_shape(img.shape, params['demosaic_algorithm']), img.dtype)
+
+  return run_stage(profiler, 'demosaic', demosaic, img, params['demosaic_pattern'], params['demosaic_algorithm'], dst=dst)
+
+# -----------------------------------------------------------------------
+
+def image_enhance_head(img, params, arena=None, profiler=None):
+  """ image_enhance stages preceding the NonLocal Denoise: Gamma Correction + Histogram Equalization + CLAHE + Local Denoise
+      (sharpening_mode='lightness' sharpens the Lightness right after CLAHE, instead of the BGR image after the NonLocal Denoise).
+      The output is of the bit_depth param working depth (uint8 or uint16) """
 
-  gamma_img = gamma_correction(img, params['gamma'])
-  histeq_img = histeq(gamma_img.astype(np.uint8))
-  clahe_img = clahe(histeq_img, params['clahe_grid'])
+  shape = img.shape
+  bit_depth = params['bit_depth']
+  work_dtype = np.uint8 if bit_depth == 8 else np.uint16
+  buf, swap = arena_helpers(arena, shape, work_dtype)
+
+  if img.dtype == work_dtype:
+    gamma_img = run_stage(profiler, 'gamma', gamma_correction, img, params['gamma'], dst=buf('ping', shape, work_dtype))
+  else:
+    gamma_img = run_stage(profiler, 'gamma', gamma_correction, img, params['gamma'], dst=buf('gamma', shape, img.dtype))
+    gamma_img = run_stage(profiler, 'to_uint%d' % bit_depth, to_bit_depth, gamma_img, bit_depth, dst=buf('ping', shape, work_dtype))
+  clahe_img = run_stage(profiler, 'histeq_clahe', histeq_clahe, gamma_img, params['clahe_grid'], params['clahe_clip_limit'], dst=swap(gamma_img),
+                        lab=buf('lab', shape, np.uint8 if bit_depth == 8 else np.float32), l_plane=buf('l_plane', shape[:2], work_dtype),
+                        sharpen=sharpening_kwargs(params) if params['sharpening_mode'] == 'lightness' else None)
   if params['denoise_mode'] == 'disabled':
     denoise_img = clahe_img
   else:
-    denoise_img = denoise(clahe_img, params['denoise_mode'], params['denoise_median_kernel'], params['denoise_d'],
-                          params['denoise_sigmaColor'], params['denoise_sigmaSpace'])
-  nl_denoise_img = nl_denoise(denoise_img, params['nl_denoise_h'], params['nl_denoise_template_win'], params['nl_denoise_search_win'],
-                              params['nl_denoise_temporal_index'], params['nl_demnoise_temporal_window'])
-  if params['sharpening_mode'] == 'disabled':
-    sat_img = saturation(nl_denoise_img, params['saturation'])
+    denoise_img = run_stage(profiler, 'denoise', denoise, clahe_img, params['denoise_mode'], params['denoise_median_kernel'], params['denoise_d'],
+                            params['denoise_sigmaColor'], params['denoise_sigmaSpace'], dst=swap(clahe_img))
+
+  return denoise_img
+
+# -----------------------------------------------------------------------
+
+def image_enhance_tail(img, params, arena=None, profiler=None):
+  """ image_enhance stages following the NonLocal Denoise: Sharpening + Saturation + Colorize (img may be overwritten),
+      then the quantization of a uint16 (16-bit mode) image to uint8 """
+
+  buf, swap = arena_helpers(arena, img.shape, img.dtype)
+
+  if params['sharpening_mode'] != 'enabled':
+    sat_img = run_stage(profiler, 'saturation', saturation, img, params['saturation'], dst=img)
+  else:
+    sharp_img = run_stage(profiler, 'sharpening', sharpening, img, dst=swap(img), **sharpening_kwargs(params))
+    sat_img = run_stage(profiler, 'saturation', saturation, sharp_img, params['saturation'], dst=sharp_img)
+  if params['colorize_mode'] == 'disabled':
+    res = sat_img
   else:
-    sharp_img = sharpening(nl_denoise_img)
-    sat_img = saturation(sharp_img, params['saturation'])
+    res = run_stage(profiler, 'colorize', colorize_bgr, sat_img, params['colorize_hue'], dst=sat_img)
+  if res.dtype != np.uint8:
+    res = run_stage(profiler, 'quantize', quantize, res, dst=buf('out', res.shape))
+
+  return res
+
+# -----------------------------------------------------------------------
+
+def image_enhance(img, params, arena=None, profiler=None):
+  """ [Demosaic] + Gamma Correction + Histogram Equalization + CLAHE + Local Denoise + Sharpening + NonLocal Denoise + Saturation + Colorize
+      img is either a BGR frame or a raw (2D) one, demosaiced first by the demosaic_pattern/demosaic_algorithm params.
+      With bit_depth=16, all the stages run on uint16 data (LAB in float32, the denoisers on 8-bit residuals, see
+      residual_8bit), and the output is quantized to uint8 once, at the end. bit_depth=8 narrows the gamma corrected
+      image to uint8 (16-bit values wrap around, as always did).
+      With a BufferArena, all stages run with dst= outputs ping-ponging between two arena frames, and the
+      returned image is an arena buffer (valid until the next call with the same arena).
+      With a StageProfiler, every stage is recorded (see image_enhancement_profiler) """
+
+  if profiler is not None:
+    profiler.begin_frame()
+
+  img = image_enhance_demosaic(img, params, arena, profiler)
+  swap = arena_helpers(arena, img.shape, np.uint8 if params['bit_depth'] == 8 else np.uint16)[1]
+
+  head_img = image_enhance_head(img, params, arena, profiler)
+  nl_denoise_img = run_stage(profiler, 'nl_denoise', nl_denoise, head_img, params['nl_denoise_h'], params['nl_denoise_template_win'],
+                             params['nl_denoise_search_win'], params['nl_denoise_temporal_index'], params['nl_demnoise_temporal_window'],
+                             params['nl_denoise_tile_size'], params['nl_denoise_workers'], dst=swap(head_img))
+  res = image_enhance_tail(nl_denoise_img, params, arena, profiler)
+
+  return res
+
+# -----------------------------------------------------------------------
 
-  return sat_img
+def image_enhance_stream(frames, params, arena=None, profiler=None):
+  """ Streaming temporal mode of image_enhance, over an iterable of (BGR or raw) frames of the same camera (e.g. a burst generator).
+      The head stages run once per frame into a ring buffer of nl_demnoise_temporal_window frames, and each frame is
+      NonLocal denoised together with its temporal neighbors, so it is emitted temporal_window//2 frames after its arrival.
+      The window shrinks symmetrically at both ends of the sequence. With a BufferArena, each yielded frame is an arena
+      buffer, valid until the next one is requested """
+
+  half = params['nl_demnoise_temporal_window'] // 2
+  window = 2 * half + 1
+  ring = []
+
+  def emit(k, count):
+    if profiler is not None:
+      profiler.begin_frame(k)
+    radius = min(half, k, count - 1 - k)
+    dst = None if arena is None else arena.get('ping', ring[0].shape, ring[0].dtype)
+    if radius == 0:
+      nl_img = run_stage(profiler, 'nl_denoise', nl_denoise, ring[k % window], params['nl_denoise_h'], params['nl_denoise_template_win'],
+                         params['nl_denoise_search_win'], tile_size=params['nl_denoise_tile_size'], workers=params['nl_denoise_workers'], dst=dst)
+    else:
+      frames_list = [ring[j % window] for j in range(k - radius, k + radius + 1)]
+      nl_img = run_stage(profiler, 'nl_denoise', nl_denoise, frames_list, params['nl_denoise_h'], params['nl_denoise_template_win'],
+                         params['nl_denoise_search_win'], radius, 2 * radius + 1, dst=dst)
+    return image_enhance_tail(nl_img, params, arena, profiler)
+
+  count = 0
+  for frame in frames:
+    if profiler is not None:
+      profiler.begin_frame(count)
+    head_img = image_enhance_head(image_enhance_demosaic(frame, params, arena, profiler), params, arena, profiler)
+    if not ring:
+      ring = [np.empty_like(head_img) for _ in range(window)]
+    np.copyto(ring[count % window], head_img)
+    count += 1
+    if count > half:
+      yield emit(count - 1 - half, count)
+
+  for k in range(max(count - half, 0), count):
+    yield emit(k, count)
 
 # -----------------------------------------------------------------------
 
@@ -196,9 +707,15 @@ def image_enhance_defparams():
 
   params = {
 
+    'demosaic_pattern': 'BG',
+    'demosaic_algorithm': 'bilinear',
+
+    'bit_depth': 8,
+
     'gamma': 0.001,
 
     'clahe_grid': 8,
+    'clahe_clip_limit': 2.0,
 
     'denoise_mode': 'disabled',
     'denoise_median_kernel': 11,
@@ -211,46 +728,56 @@ def image_enhance_defparams():
     'nl_denoise_search_win': 21,
     'nl_denoise_temporal_index': 2,
     'nl_demnoise_temporal_window': 3,
+    'nl_denoise_tile_size': 0,
+    'nl_denoise_workers': 0,
 
     'sharpening_mode': 'enabled',
+    'sharpening_method': 'kernel',
+    'sharpening_amount': 1.0,
+    'sharpening_radius': 1.0,
+
+    'saturation': 1.1,
 
-    'saturation': 1.1
+    'colorize_mode': 'disabled',
+    'colorize_hue': 30
   }
 
   return params
 
 # -----------------------------------------------------------------------
 
-if __name__ == "__main__":
-
-  print('Started')
-
-  print('OpenCV version: %s' % cv2.__version__)
-  print('Tensorflow version: %s' % tf.__version__)
-
-  data_dir = '/Users/shahargino/data/tracxpoint__data'
-  img_files_list = [str(x) for x in Path(data_dir).rglob('*.tif')]
-  print('%d images found' % len(img_files_list))
-
-  params = image_enhance_defparams()
-
-  for k, img_file in enumerate(img_files_list):
+class ImageEnhancePipeline(object):
+  """ Reusable image_enhance runner, owning the BufferArena of a given frame shape.
+      The returned frame is overwritten by the next call, copy it if it has to be kept """
+
+  def __init__(self, params=None, shape=None, dtype=np.uint8):
+    self.params = image_enhance_defparams() if params is None else params
+    self.arena = BufferArena()
+    if shape is not None:
+      self.allocate(shape, dtype)
+
+  def allocate(self, shape, dtype=np.uint8):
+    if len(shape) == 2:
+      shape = demosaic_shape(shape, self.params['demosaic_algorithm'])
+      self.arena.get('demosaic', shape, dtype)
+    work_dtype = np.uint8 if self.params['bit_depth'] == 8 else np.uint16
+    for name in ('ping', 'pong'):
+      self.arena.get(name, shape, work_dtype)
+    self.arena.get('lab', shape, np.uint8 if work_dtype == np.uint8 else np.float32)
+    self.arena.get('l_plane', shape[:2], work_dtype)
+    if np.dtype(dtype) != work_dtype:
+      self.arena.get('gamma', shape, dtype)
+    if work_dtype != np.uint8:
+      self.arena.get('out', shape)
+
+  def __call__(self, img):
+    return image_enhance(img, self.params, self.arena)
 
-    print('Processing (%d/%d): %s' % (k+1, len(img_files_list), img_file))
-
-    bayer_img = cv2.imread(img_file, cv2.IMREAD_UNCHANGED)
-    tif_img = cv2.cvtColor(bayer_img, cv2.COLOR_BAYER_BG2BGR)
-
-    res_img = image_enhance(tif_img, params)
-
-    tif_score = iqa_score(tif_img.astype(np.uint8))
-    res_score = iqa_score(res_img)
-
-    out_file = img_file.replace(data_dir, 'results').replace('.tif', '_iqa_%.2f_to_%.2f.tif' % (tif_score, res_score))
-    out_dir = path.dirname(out_file)
-    if not path.exists(out_dir):
-      makedirs(out_dir)
-    cv2.imwrite(out_file, res_img)
+# -----------------------------------------------------------------------
 
-  print('completed successfully')
+if __name__ == "__main__":
 
+  # Batch mode lives in image_enhancement_batch (process-pool driver, see --help there):
+  import sys
+  from image_enhancement_batch import main
+  sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import cv2
+import sys
+import json
+import argparse
+import numpy as np
+from time import perf_counter
+from pathlib import Path
+from os import path, cpu_count
+from functools import partial
+from collections import deque, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from image_enhancement import demosaic, image_enhance, image_enhance_defparams, iqa_score, iqa_score_batch, BufferArena
+from image_enhancement_profiler import StageProfiler, print_profile_summary, write_profile_report
+from image_enhancement_iqa_cache import IqaScoreCache, default_iqa_cache_file, print_iqa_cache_stats, demosaic_variant
+from image_enhancement_io import read_bayer, prefetch, write_image
+
+default_data_dir = '/Users/shahargino/data/tracxpoint__data'
+default_results_dir = 'results'
+
+# Frame buffers reused by all the files processed within this (worker) process, one arena per result which may be
+# pending write (see process_files):
+worker_arenas = defaultdict(BufferArena)
+
+# IQA scores caches of this (worker) process, opened on first use, by cache options:
+worker_iqa_caches = {}
+
+# -----------------------------------------------------------------------
+
+def init_worker():
+  """ Process-pool initializer, avoids OpenCV threads oversubscription when running several workers """
+
+  cv2.setNumThreads(1)
+
+# -----------------------------------------------------------------------
+
+def worker_iqa_cache(iqa_cache):
+  """ IqaScoreCache of this process for iqa_cache, being IqaScoreCache keyword arguments """
+
+  key = tuple(sorted(iqa_cache.items()))
+  if key not in worker_iqa_caches:
+    worker_iqa_caches[key] = IqaScoreCache(**iqa_cache)
+
+  return worker_iqa_caches[key]
+
+# -----------------------------------------------------------------------
+
+def read_frame(img_file, params):
+  """ Read + Demosaic (by the params demosaic_pattern/demosaic_algorithm) of a Bayer TIFF, returns (frame, timings) """
+
+  timings = {}
+
+  t = perf_counter()
+  bayer_img = read_bayer(img_file)
+  timings['read'] = perf_counter() - t
+
+  t = perf_counter()
+  tif_img = demosaic(bayer_img, params['demosaic_pattern'], params['demosaic_algorithm'])
+  timings['demosaic'] = perf_counter() - t
+
+  return tif_img, timings
+
+# -----------------------------------------------------------------------
+
+def process_files(img_files, data_dir, results_dir, params, profile=False, iqa_cache=None, prefetch_depth=2, write_depth=2):
+  """ Pipelined per-file flow: Read + Demosaic --> Enhance + IQA --> Write
+      Up to prefetch_depth frames are read ahead, and up to write_depth results are written behind, on background
+      threads, so that Enhance + IQA do not wait for the disk. Yields one result per file, in order, once written.
+      Never raises, errors are reported back within the result dictionaries ('io_wait' being the time spent waiting
+      for the reader/writer threads).
+      With profile=True, image_enhance stage records are returned as well (see image_enhancement_profiler).
+      With iqa_cache (IqaScoreCache keyword arguments), the input (unenhanced) score is read from / stored into that cache """
+
+  write_depth = max(1, write_depth)
+  known_dirs = set()
+
+  def written(res, job):
+    if job is not None:
+      t = perf_counter()
+      try:
+        res['timings']['write'] = job.result()
+      except Exception as e:
+        res['error'] = '%s: %s' % (type(e).__name__, str(e))
+      res['timings']['io_wait'] += perf_counter() - t
+    return res
+
+  with ThreadPoolExecutor(1) as writer:
+    pending = deque()
+    for k, (img_file, frame_job) in enumerate(zip(img_files, prefetch(partial(read_frame, params=params), img_files, prefetch_depth))):
+
+      # The result to be enhanced next reuses the arena of the one written write_depth files ago:
+      if len(pending) >= write_depth:
+        yield written(*pending.popleft())
+
+      res = {'file': img_file, 'error': None, 'timings': {}, 'profile': [], 'iqa_cache_hit': None}
+      timings = res['timings']
+      profiler = StageProfiler() if profile else None
+      job = None
+
+      try:
+        t = perf_counter()
+        tif_img, read_timings = frame_job.result()
+        io_wait = perf_counter() - t
+        timings.update(read_timings)
+
+        t = perf_counter()
+        res_img = image_enhance(tif_img, params, worker_arenas[k % write_depth], profiler)
+        timings['enhance'] = perf_counter() - t
+        if profiler is not None:
+          res['profile'] = [dict(r, file=img_file) for r in profiler.records]
+
+        t = perf_counter()
+        if iqa_cache:
+          cache = worker_iqa_cache(iqa_cache)
+          hits = cache.hits
+          tif_score = cache.score(img_file, lambda: tif_img.astype(np.uint8), iqa_score, variant=demosaic_variant(params))
+          res['iqa_cache_hit'] = cache.hits > hits
+          res_score = iqa_score(res_img)
+        else:
+          tif_score, res_score = iqa_score_batch([tif_img.astype(np.uint8), res_img])
+        timings['iqa'] = perf_counter() - t
+        timings['io_wait'] = io_wait
+
+        rel_file = path.relpath(img_file, data_dir)
+        out_file = path.join(results_dir, rel_file).replace('.tif', '_iqa_%.2f_to_%.2f.tif' % (tif_score, res_score))
+        job = writer.submit(write_image, out_file, res_img, known_dirs)
+
+        res.update({'out_file': out_file, 'tif_score': tif_score, 'res_score': res_score})
+
+      except Exception as e:
+        res['error'] = '%s: %s' % (type(e).__name__, str(e))
+
+      pending.append((res, job))
+
+    while pending:
+      yield written(*pending.popleft())
+
+def process_file(img_file, data_dir, results_dir, params, profile=False, iqa_cache=None):
+  """ Complete flow of a single file (see process_files) """
+
+  return next(process_files([img_file], data_dir, results_dir, params, profile, iqa_cache))
+
+def process_chunk(img_files, data_dir, results_dir, params, profile=False, iqa_cache=None, prefetch_depth=2, write_depth=2):
+  """ process_files results list, for the process pool """
+
+  return list(process_files(img_files, data_dir, results_dir, params, profile, iqa_cache, prefetch_depth, write_depth))
+
+# -----------------------------------------------------------------------
+
+def batch_enhance(img_files_list, data_dir, results_dir, params, workers=1, max_inflight=None, profile=False, iqa_cache=None,
+                  prefetch_depth=2, write_depth=2, chunk_size=8):
+  """ Runs process_files over img_files_list, yielding results in input order. With several workers, the files are
+      split into chunks of chunk_size consecutive files, each one pipelined within a process pool worker, and at most
+      max_inflight chunks are submitted ahead of the one being reported (default 2*workers) """
+
+  if workers <= 1:
+    yield from process_files(img_files_list, data_dir, results_dir, params, profile, iqa_cache, prefetch_depth, write_depth)
+    return
+
+  if max_inflight is None:
+    max_inflight = 2 * workers
+
+  with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+    pending = deque()
+    for k in range(0, len(img_files_list), chunk_size):
+      pending.append(executor.submit(process_chunk, img_files_list[k:k+chunk_size], data_dir, results_dir, params, profile,
+                                     iqa_cache, prefetch_depth, write_depth))
+      if len(pending) >= max_inflight:
+        yield from pending.popleft().result()
+    while pending:
+      yield from pending.popleft().result()
+
+# -----------------------------------------------------------------------
+
+def print_summary(results, elapsed):
+  """ Throughput summary: frames/s and mean per-stage time over the successfully processed files """
+
+  ok = [r for r in results if r['error'] is None]
+  failed = [r for r in results if r['error'] is not None]
+
+  print('%d processed, %d failed, %.2f sec total' % (len(ok), len(failed), elapsed))
+  if elapsed > 0:
+    print('Throughput: %.2f frames/s' % (len(ok) / elapsed))
+
+  if ok:
+    stages = ok[0]['timings'].keys()
+    for stage in stages:
+      stage_times = [r['timings'][stage] for r in ok]
+      print('  %-10s mean %.3f sec, total %.2f sec' % (stage, np.mean(stage_times), np.sum(stage_times)))
+
+  for r in failed:
+    print('  FAILED %s --> %s' % (r['file'], r['error']))
+
+# -----------------------------------------------------------------------
+
+def main(argv=None):
+
+  parser = argparse.ArgumentParser(description='Image Enhancement - batch mode')
+  parser.add_argument('-i', '--input', default=default_data_dir, help='input directory, scanned recursively')
+  parser.add_argument('-o', '--output', default=default_results_dir, help='output (results) directory')
+  parser.add_argument('-j', '--workers', type=int, default=cpu_count(), help='number of worker processes')
+  parser.add_argument('--max-inflight', type=int, default=None, help='max chunks in flight (default: 2*workers)')
+  parser.add_argument('--chunk-size', type=int, default=8, help='consecutive files per worker task')
+  parser.add_argument('--prefetch', type=int, default=2, help='frames read ahead, per worker')
+  parser.add_argument('--write-behind', type=int, default=2, help='results written behind, per worker')
+  parser.add_argument('--pattern', default='*.tif', help='input files glob pattern')
+  parser.add_argument('--params', default=None, help='JSON file of image_enhance parameters overriding the defaults (e.g. from image_enhancement_tuner)')
+  parser.add_argument('--profile', default=None, metavar='REPORT', help='profile image_enhance stages into a .json/.csv report')
+  parser.add_argument('--iqa-cache', default=default_iqa_cache_file, metavar='FILE', help='input IQA scores cache file')
+  parser.add_argument('--iqa-cache-max-entries', type=int, default=100000, help='input IQA scores cache entries (LRU eviction)')
+  parser.add_argument('--iqa-cache-max-mb', type=float, default=None, help='input IQA scores cache file size, in MB (LRU eviction, default: no limit)')
+  parser.add_argument('--iqa-cache-hash', action='store_true', help='identify cached files by content hash (default: path+mtime+size)')
+  parser.add_argument('--no-iqa-cache', action='store_true', help='always score the input files')
+  args = parser.parse_args(argv)
+
+  print('Started')
+
+  print('OpenCV version: %s' % cv2.__version__)
+
+  img_files_list = sorted(str(x) for x in Path(args.input).rglob(args.pattern))
+  print('%d images found' % len(img_files_list))
+
+  params = image_enhance_defparams()
+  if args.params is not None:
+    with open(args.params) as f:
+      params.update(json.load(f))
+
+  results = []
+  t_start = perf_counter()
+
+  iqa_cache_options = None
+  if not args.no_iqa_cache:
+    iqa_cache_options = {'filename': args.iqa_cache, 'max_entries': args.iqa_cache_max_entries, 'hash_content': args.iqa_cache_hash,
+                         'max_bytes': None if args.iqa_cache_max_mb is None else int(args.iqa_cache_max_mb * 2**20)}
+
+  results_iter = batch_enhance(img_files_list, args.input, args.output, params, args.workers, args.max_inflight,
+                               args.profile is not None, iqa_cache_options, args.prefetch, args.write_behind, args.chunk_size)
+
+  for k, res in enumerate(results_iter):
+    results.append(res)
+    if res['error'] is None:
+      print('Processed (%d/%d): %s --> %.2f to %.2f' % (k+1, len(img_files_list), res['file'], res['tif_score'], res['res_score']))
+    else:
+      print('Failed (%d/%d): %s --> %s' % (k+1, len(img_files_list), res['file'], res['error']))
+
+  print_summary(results, perf_counter() - t_start)
+
+  if iqa_cache_options is not None:
+    iqa_cache = IqaScoreCache(**iqa_cache_options)
+    iqa_cache.hits = sum(1 for r in results if r['iqa_cache_hit'])
+    iqa_cache.misses = sum(1 for r in results if r['iqa_cache_hit'] is False)
+    iqa_cache.evict()
+    print_iqa_cache_stats(iqa_cache.stats())
+    iqa_cache.close()
+
+  if args.profile is not None:
+    records = [r for res in results for r in res['profile']]
+    print('Stages profile (sec):')
+    print_profile_summary(records)
+    write_profile_report(records, args.profile)
+    print('Profile report: %s' % args.profile)
+
+  print('completed')
+
+  return 1 if any(r['error'] is not None for r in results) else 0
+
+# -----------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+  sys.exit(main())
@@ -0,0 +1,653 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from os import path, makedirs
+from datetime import datetime
+from time import perf_counter
+
+# -----------------------------------------------------------------------
+
+startup_probe = '''
+import sys, resource
+from time import perf_counter
+rss_unit = 1024. * 1024. if sys.platform == 'darwin' else 1024.
+t = perf_counter()
+for module_name in sys.argv[1:]:
+  __import__(module_name)
+t = perf_counter() - t
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('%f %f' % (t, rss / rss_unit))
+'''
+
+startup_targets = {
+  'image_enhancement': ['image_enhancement'],
+  'former_imports': ['cv2', 'numpy', 'tensorflow', 'matplotlib.pyplot', 'PIL.Image', 'imquality.brisque'],
+}
+
+def bench_startup(args):
+  """ Cold import time and peak RSS, each sample measured on a fresh interpreter """
+
+  results = {}
+
+  for name, modules in startup_targets.items():
+    samples = []
+    for _ in range(args.repeat):
+      proc = subprocess.run([sys.executable, '-c', startup_probe] + modules, capture_output=True, text=True)
+      if proc.returncode != 0:
+        break
+      samples.append([float(x) for x in proc.stdout.split()])
+
+    if not samples:
+      print('  %-20s not available (%s)' % (name, proc.stderr.strip().splitlines()[-1]))
+      continue
+
+    import_time = min(s[0] for s in samples)
+    rss = min(s[1] for s in samples)
+    results[name] = {'import_time': import_time, 'rss_mb': rss}
+    print('  %-20s import %.3f sec, peak RSS %.1f MB' % (name, import_time, rss))
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def synthetic_frame(height, width, seed=0, dtype=np.uint8):
+  """ Smooth low-saturation BGR scene + sensor-like noise, deterministic per seed """
+
+  import cv2
+
+  rng = np.random.default_rng(seed)
+  base = rng.integers(0, 256, (height, width), dtype=np.uint8)
+  base = cv2.GaussianBlur(base, (0, 0), max(height, width) / 160.)
+  base = cv2.normalize(base, None, 0, 255, cv2.NORM_MINMAX)
+  img = cv2.merge([base, cv2.add(base, 10), cv2.subtract(base, 15)])
+  noise = rng.normal(0, 4, img.shape)
+
+  img = np.clip(img + noise, 0, 255)
+
+  return (img * (np.iinfo(dtype).max / 255.)).astype(dtype)
+
+def synthetic_bayer(height, width, seed=0, dtype=np.uint8):
+  """ Synthetic raw frame, the synthetic_frame scene mosaiced for cv2.COLOR_BAYER_BG2BGR
+      (OpenCV's BG naming: R at (0,0), G at (0,1) and (1,0), B at (1,1)) """
+
+  img = synthetic_frame(height, width, seed, dtype)
+
+  bayer = np.empty((height, width), dtype)
+  bayer[0::2,0::2] = img[0::2,0::2,2]
+  bayer[0::2,1::2] = img[0::2,1::2,1]
+  bayer[1::2,0::2] = img[1::2,0::2,1]
+  bayer[1::2,1::2] = img[1::2,1::2,0]
+
+  return bayer
+
+def write_synthetic_dataset(data_dir, resolutions, bits):
+  """ Writes synthetic Bayer TIFFs (bayer_<H>x<W>_<bits>bit.tif) for every resolution and bit depth, returns their paths """
+
+  import cv2
+
+  makedirs(data_dir, exist_ok=True)
+
+  files = []
+  for height, width in resolutions:
+    for n_bits in bits:
+      img_file = path.join(data_dir, 'bayer_%dx%d_%dbit.tif' % (height, width, n_bits))
+      if not path.exists(img_file):
+        cv2.imwrite(img_file, synthetic_bayer(height, width, dtype=np.uint8 if n_bits == 8 else np.uint16))
+      files.append(img_file)
+
+  return files
+
+def timeit(func, repeat):
+  """ Best wall time of func() over repeat runs """
+
+  best = float('inf')
+  for _ in range(repeat):
+    t = perf_counter()
+    func()
+    best = min(best, perf_counter() - t)
+
+  return best
+
+# Names of the correctness checks which failed (main exits with a non-zero status if any):
+failed_checks = []
+
+def verdict(check, ok):
+  """ 'PASS' or 'FAIL' of a correctness check, a failed one is recorded into failed_checks """
+
+  if not ok:
+    failed_checks.append(check)
+
+  return 'PASS' if ok else 'FAIL'
+
+# -----------------------------------------------------------------------
+
+def bench_lab(args):
+  """ Fused histeq_clahe vs. the former clahe(histeq(img)) chain: timing and output tolerance.
+      Color outputs are not bit-exact, the two-step chain re-quantizes through 8-bit BGR in between """
+
+  import cv2
+  from image_enhancement import histeq, clahe, histeq_clahe
+
+  img = synthetic_frame(args.height, args.width)
+
+  ref = clahe(histeq(img))
+  res = histeq_clahe(img)
+  diff = np.abs(ref.astype(np.int16) - res)
+  psnr = cv2.PSNR(ref, res)
+  ok = psnr > args.lab_min_psnr and np.array_equal(clahe(histeq(img[:,:,0])), histeq_clahe(img[:,:,0]))
+
+  t_ref = timeit(lambda: clahe(histeq(img)), args.repeat)
+  t_res = timeit(lambda: histeq_clahe(img), args.repeat)
+
+  print('  histeq+clahe %.3f sec, fused %.3f sec (x%.2f)' % (t_ref, t_res, t_ref / t_res))
+  print('  abs diff: max %d, mean %.3f, PSNR %.2f dB, gray bit-exact --> %s' % (diff.max(), diff.mean(), psnr, verdict('lab', ok)))
+
+  return {'two_step': t_ref, 'fused': t_res, 'max_diff': int(diff.max()), 'mean_diff': float(diff.mean()), 'psnr': psnr, 'ok': ok}
+
+# -----------------------------------------------------------------------
+
+def colorize_reference(img, hue):
+  """ Former per-pixel colorsys implementation of colorize, on a BGR uint8 array """
+
+  import colorsys
+
+  rgb_to_hsv = np.vectorize(colorsys.rgb_to_hsv)
+  hsv_to_rgb = np.vectorize(colorsys.hsv_to_rgb)
+
+  b, g, r = np.rollaxis(img.astype('float'), axis=-1)
+  h, s, v = rgb_to_hsv(r, g, b)
+  r, g, b = hsv_to_rgb(hue/360., s, v)
+
+  return np.dstack((b, g, r)).astype('uint8')
+
+def bench_colorize(args):
+  """ Vectorized colorize_bgr vs. the former colorsys implementation (timed on a crop, extrapolated per pixel) """
+
+  from image_enhancement import colorize_bgr
+
+  img = synthetic_frame(args.height, args.width)
+  crop = img[:256,:256]
+
+  max_diff = max(np.abs(colorize_reference(crop, hue).astype(np.int16) - colorize_bgr(crop, hue)).max() for hue in (0, 30, 200, 359))
+  ok = max_diff <= 1
+
+  t_ref = timeit(lambda: colorize_reference(crop, 30), 1) * img[:,:,0].size / crop[:,:,0].size
+  t_res = timeit(lambda: colorize_bgr(img, 30), args.repeat)
+
+  print('  colorsys %.1f sec (extrapolated), vectorized %.3f sec (x%.0f)' % (t_ref, t_res, t_ref / t_res))
+  print('  abs diff: max %d --> %s' % (max_diff, verdict('nl_tiles', ok)))
+
+  return {'colorsys': t_ref, 'vectorized': t_res, 'max_diff': int(max_diff), 'ok': ok}
+
+# -----------------------------------------------------------------------
+
+def bench_arena(args):
+  """ image_enhance with per-stage allocations vs. ImageEnhancePipeline (BufferArena): time and peak memory per frame """
+
+  import tracemalloc
+  from image_enhancement import image_enhance, image_enhance_defparams, ImageEnhancePipeline
+
+  img = synthetic_frame(args.height, args.width, dtype=np.uint16)
+  params = image_enhance_defparams()
+  pipeline = ImageEnhancePipeline(params, img.shape, img.dtype)
+
+  results = {}
+  for name, func in (('allocating', lambda: image_enhance(img, params)), ('arena', lambda: pipeline(img))):
+    func()
+    tracemalloc.start()
+    t = timeit(func, args.repeat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results[name] = {'time': t, 'peak_mb': peak / 2.**20}
+    print('  %-12s %.3f sec/frame, peak allocated %.1f MB/frame' % (name, t, peak / 2.**20))
+
+  print('  arena size: %.1f MB' % (pipeline.arena.nbytes() / 2.**20))
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def bench_nl_tiles(args):
+  """ Tiled nl_denoise scaling over worker counts (OpenCV internal threads disabled), and PSNR vs. untiled """
+
+  import cv2
+  from os import cpu_count
+  from image_enhancement import nl_denoise
+
+  img = synthetic_frame(args.height, args.width)
+
+  ref = nl_denoise(img)
+  t_ref = timeit(lambda: nl_denoise(img), args.repeat)
+  print('  untiled (OpenCV threads: %d) %.3f sec' % (cv2.getNumThreads(), t_ref))
+  results = {'untiled': t_ref, 'tiled': {}}
+
+  num_threads = cv2.getNumThreads()
+  cv2.setNumThreads(1)
+  workers = 1
+  while workers <= cpu_count():
+    res = nl_denoise(img, tile_size=args.tile_size, workers=workers)
+    psnr = cv2.PSNR(ref, res)
+    t = timeit(lambda: nl_denoise(img, tile_size=args.tile_size, workers=workers), args.repeat)
+    results['tiled'][workers] = {'time': t, 'psnr': psnr}
+    print('  tiled %d workers: %.3f sec, PSNR vs. untiled %.2f dB' % (workers, t, psnr))
+    workers *= 2
+  cv2.setNumThreads(num_threads)
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def bench_suite(args):
+  """ Every image_enhancement function, and the full image_enhance under the default params,
+      on synthetic Bayer TIFFs of several resolutions and bit depths. Results are in seconds per call """
+
+  import cv2
+  from image_enhancement import gamma_correction, histeq, clahe, denoise, nl_denoise, sharpening, saturation, \
+                                iqa_score, image_enhance, image_enhance_defparams
+  from image_enhancement_io import load_frame
+
+  params = image_enhance_defparams()
+  data_dir = args.data_dir or path.join(tempfile.gettempdir(), 'tracxpoint_imgenhance_bench')
+  resolutions = [tuple(int(n) for n in r.split('x')) for r in args.resolutions.split(',')]
+  bits = [int(b) for b in args.bits.split(',')]
+
+  try:
+    import imquality.brisque
+    with_iqa = True
+  except ImportError:
+    print('  imquality is not available, skipping iqa_score')
+    with_iqa = False
+
+  results = {}
+  for img_file in write_synthetic_dataset(data_dir, resolutions, bits):
+
+    tif_img = load_frame(img_file)
+    img = gamma_correction(tif_img, params['gamma']).astype(np.uint8)
+
+    funcs = {
+      'gamma_correction': lambda: gamma_correction(tif_img, params['gamma']),
+      'histeq': lambda: histeq(img),
+      'clahe': lambda: clahe(img, params['clahe_grid'], params['clahe_clip_limit']),
+      'denoise': lambda: denoise(img, 'bilateral', params['denoise_median_kernel'], params['denoise_d'],
+                                 params['denoise_sigmaColor'], params['denoise_sigmaSpace']),
+      'nl_denoise': lambda: nl_denoise(img, params['nl_denoise_h'], params['nl_denoise_template_win'], params['nl_denoise_search_win']),
+      'sharpening': lambda: sharpening(img),
+      'saturation': lambda: saturation(img, params['saturation']),
+      'iqa_score': lambda: iqa_score(img),
+      'image_enhance': lambda: image_enhance(tif_img, params),
+    }
+    if not with_iqa:
+      del funcs['iqa_score']
+
+    case = path.basename(img_file)[len('bayer_'):-len('.tif')]
+    results[case] = {}
+    for name, func in funcs.items():
+      results[case][name] = timeit(func, args.repeat)
+      print('  %-16s %-18s %.4f sec' % (case, name, results[case][name]))
+
+  return results
+
+def compare_suite(results, baseline, tolerance):
+  """ Compares suite timings to a baseline (as saved by --save), returns the list of regressions """
+
+  regressions = []
+  for case, funcs in results.items():
+    for name, t in funcs.items():
+      t_base = baseline.get(case, {}).get(name)
+      if t_base is None:
+        continue
+      ratio = t / t_base
+      flag = ''
+      if ratio > 1. + tolerance:
+        flag = 'REGRESSION'
+        regressions.append((case, name, ratio))
+      print('  %-16s %-18s %.4f --> %.4f sec (x%.2f) %s' % (case, name, t_base, t, ratio, flag))
+
+  return regressions
+
+# -----------------------------------------------------------------------
+
+def bench_brisque(args):
+  """ Native BRISQUE (image_enhancement_brisque) vs. imquality.brisque: timing and scores agreement """
+
+  import cv2
+  from image_enhancement import iqa_score, iqa_score_batch
+  from image_enhancement_brisque import brisque_model
+
+  try:
+    brisque_model()
+  except ImportError as e:
+    print('  %s, skipping' % e)
+    return {}
+
+  imgs = [synthetic_frame(args.height, args.width, seed) for seed in range(4)]
+  imgs += [cv2.GaussianBlur(imgs[0], (0, 0), 3), cv2.add(imgs[1], np.random.default_rng(0).integers(0, 50, imgs[1].shape, dtype=np.uint8))]
+
+  t_native = timeit(lambda: [iqa_score(img) for img in imgs], args.repeat) / len(imgs)
+  t_batch = timeit(lambda: iqa_score_batch(imgs), args.repeat) / len(imgs)
+  print('  native %.4f sec/image, batch %.4f sec/image' % (t_native, t_batch))
+  results = {'native': t_native, 'batch': t_batch}
+
+  try:
+    import imquality.brisque
+  except ImportError:
+    print('  imquality is not available, skipping the comparison')
+    return results
+
+  ref = [iqa_score(img, native=False) for img in imgs]
+  res = iqa_score_batch(imgs)
+  max_diff = np.abs(np.array(ref) - res).max()
+  t_ref = timeit(lambda: [iqa_score(img, native=False) for img in imgs], args.repeat) / len(imgs)
+  ok = max_diff < args.brisque_tolerance
+
+  print('  imquality %.4f sec/image (x%.1f)' % (t_ref, t_ref / t_batch))
+  print('  scores abs diff: max %.5f --> %s' % (max_diff, verdict('brisque', ok)))
+  results.update({'imquality': t_ref, 'max_diff': max_diff, 'ok': ok})
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def bench_sweep(args):
+  """ SweepEngine (shared pipeline prefixes) vs. a full image_enhance per combination: time and bit-exactness """
+
+  from image_enhancement import image_enhance
+  from image_enhancement_sweep import SweepEngine, param_grid, parse_sweep
+
+  img = synthetic_frame(args.height, args.width, dtype=np.uint16)
+  grid = dict(parse_sweep(text) for text in args.sweep)
+  params_list = param_grid(grid)
+
+  t = perf_counter()
+  engine = SweepEngine(img)
+  images = engine.run(params_list)
+  t_sweep = perf_counter() - t
+
+  t = perf_counter()
+  exact = all(np.array_equal(image_enhance(img, params), res) for params, res in zip(params_list, images))
+  t_ref = perf_counter() - t
+
+  print('  %d combinations: sweep %.2f sec (%d stages computed), image_enhance loop %.2f sec (x%.1f)' %
+        (len(params_list), t_sweep, engine.stats()['stage_runs'], t_ref, t_ref / t_sweep))
+  print('  bit-exact vs. image_enhance: %s' % verdict('sweep', exact))
+
+  return {'combinations': len(params_list), 'sweep': t_sweep, 'image_enhance': t_ref, 'exact': exact}
+
+# -----------------------------------------------------------------------
+
+def bench_io(args):
+  """ Bayer TIFF loading: cv2.imread + demosaic vs. the memory-mapped load_frame, full frame and a centered ROI
+      (files are read from the page cache, i.e. decoding and copying overheads only), and the ROIs exactness of every
+      demosaic algorithm """
+
+  import cv2
+  from image_enhancement import demosaic, demosaic_algorithms
+  from image_enhancement_io import load_frame, map_bayer
+
+  try:
+    import tifffile
+  except ImportError:
+    print('  tifffile is not available, skipping')
+    return {}
+
+  data_dir = tempfile.mkdtemp(prefix='tracxpoint_imgenhance_io_')
+  roi_size = min(512, args.height, args.width)
+  y0, x0 = (args.height - roi_size) // 2, (args.width - roi_size) // 2
+  roi = (y0, y0 + roi_size, x0, x0 + roi_size)
+
+  results = {}
+  for n_bits in (8, 16):
+    img_file = path.join(data_dir, 'bayer_%dbit.tif' % n_bits)
+    tifffile.imwrite(img_file, synthetic_bayer(args.height, args.width, dtype=np.uint8 if n_bits == 8 else np.uint16))
+    mapped = map_bayer(img_file) is not None
+
+    ref = cv2.cvtColor(cv2.imread(img_file, cv2.IMREAD_UNCHANGED), cv2.COLOR_BAYER_BG2BGR)
+    exact = np.array_equal(load_frame(img_file), ref) and np.array_equal(load_frame(img_file, roi), ref[y0:y0+roi_size,x0:x0+roi_size])
+
+    # Every algorithm, the centered ROI and odd-aligned ROIs, vs. the same region of a full frame demosaic:
+    bayer = cv2.imread(img_file, cv2.IMREAD_UNCHANGED)
+    rois = [roi, (y0 + 1, y0 + roi_size // 3, x0 + 3, x0 + roi_size // 2), (0, 33, args.width - 45, args.width)]
+    exact_algorithms = {}
+    for algorithm in demosaic_algorithms:
+      if algorithm == 'vng' and n_bits != 8:
+        continue
+      full = demosaic(bayer, 'BG', algorithm)
+      exact_algorithms[algorithm] = all(np.array_equal(load_frame(img_file, (ry0, ry1, rx0, rx1), algorithm=algorithm),
+                                                       full[ry0//2:(ry1+1)//2,rx0//2:(rx1+1)//2] if algorithm == 'binning' else
+                                                       full[ry0:ry1,rx0:rx1])
+                                        for ry0, ry1, rx0, rx1 in rois)
+
+    t_ref = timeit(lambda: cv2.cvtColor(cv2.imread(img_file, cv2.IMREAD_UNCHANGED), cv2.COLOR_BAYER_BG2BGR), args.repeat)
+    t_mmap = timeit(lambda: load_frame(img_file), args.repeat)
+    t_roi = timeit(lambda: load_frame(img_file, roi), args.repeat)
+
+    print('  %2d bit: imread+demosaic %.4f sec, load_frame %.4f sec (x%.1f, %s), %dx%d ROI %.4f sec (x%.0f)' %
+          (n_bits, t_ref, t_mmap, t_ref / t_mmap, 'mapped' if mapped else 'not mapped', roi_size, roi_size, t_roi, t_ref / t_roi))
+    print('  %2d bit: identical to imread+demosaic: %s' % (n_bits, verdict('io %dbit' % n_bits, exact)))
+    print('  %2d bit: ROIs identical to a full frame demosaic: %s' %
+          (n_bits, ', '.join('%s %s' % (a, verdict('io %dbit %s ROI' % (n_bits, a), e)) for a, e in exact_algorithms.items())))
+    results['%dbit' % n_bits] = {'imread': t_ref, 'load_frame': t_mmap, 'roi': t_roi, 'mapped': mapped, 'exact': exact,
+                                 'exact_roi': exact_algorithms}
+
+  shutil.rmtree(data_dir, ignore_errors=True)
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def bench_demosaic(args):
+  """ Demosaic algorithms time, and image_enhance + iqa_score downstream of a full resolution vs. a binning demosaic """
+
+  from image_enhancement import demosaic, demosaic_algorithms, image_enhance, image_enhance_defparams, iqa_score
+  from image_enhancement_brisque import brisque_model
+
+  params = image_enhance_defparams()
+  results = {}
+
+  for n_bits, dtype in ((8, np.uint8), (16, np.uint16)):
+    bayer = synthetic_bayer(args.height, args.width, dtype=dtype)
+    for algorithm in demosaic_algorithms:
+      if algorithm == 'vng' and dtype != np.uint8:
+        continue
+      t = timeit(lambda: demosaic(bayer, 'BG', algorithm), args.repeat)
+      results['%dbit_%s' % (n_bits, algorithm)] = t
+      print('  %2d bit %-10s %.4f sec' % (n_bits, algorithm, t))
+
+  try:
+    brisque_model()
+  except ImportError as e:
+    print('  %s, skipping the downstream timing' % e)
+    return results
+
+  bayer = synthetic_bayer(args.height, args.width)
+  for algorithm in ('bilinear', 'binning'):
+    img = demosaic(bayer, 'BG', algorithm)
+    t = timeit(lambda: iqa_score(image_enhance(img, params)), 1)
+    results['downstream_%s' % algorithm] = t
+    print('  image_enhance + iqa_score of the %s output (%dx%d): %.2f sec' % (algorithm, img.shape[0], img.shape[1], t))
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def bench_bit_depth(args):
+  """ image_enhance of a 16-bit frame in the 8-bit (default) vs. the 16-bit mode: time, peak memory and arena size per frame.
+      Then the 16-bit mode widening of an 8-bit BGR frame (every channel), the outputs PSNR of both modes for that frame
+      (which the 8-bit mode does not wrap around), and the CLAHE clip limit effect in the 16-bit mode """
+
+  import cv2
+  import tracemalloc
+  from image_enhancement import image_enhance, image_enhance_defparams, ImageEnhancePipeline, histeq_clahe, gamma_correction, to_bit_depth
+
+  img = synthetic_frame(args.height, args.width, dtype=np.uint16)
+
+  results = {}
+  for bit_depth in (8, 16):
+    params = dict(image_enhance_defparams(), bit_depth=bit_depth)
+    pipeline = ImageEnhancePipeline(params, img.shape, img.dtype)
+    image_enhance(img, params)
+    tracemalloc.start()
+    t = timeit(lambda: image_enhance(img, params), args.repeat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    t_arena = timeit(lambda: pipeline(img), args.repeat)
+    results['%dbit' % bit_depth] = {'time': t, 'arena_time': t_arena, 'peak_mb': peak / 2.**20, 'arena_mb': pipeline.arena.nbytes() / 2.**20}
+    print('  %2d-bit mode: %.3f sec/frame (%.3f with an arena), peak allocated %.1f MB/frame, arena %.1f MB' %
+          (bit_depth, t, t_arena, peak / 2.**20, pipeline.arena.nbytes() / 2.**20))
+
+  img8 = synthetic_frame(args.height, args.width)
+  gamma_img = gamma_correction(img8, image_enhance_defparams()['gamma'])
+  widened = np.array_equal(to_bit_depth(gamma_img, 16), gamma_img.astype(np.uint16) * 257)
+  print('  16-bit mode of an 8-bit BGR frame, every channel widened (x257): %s' % verdict('bit_depth widening', widened))
+
+  psnr = cv2.PSNR(*[image_enhance(img8, dict(image_enhance_defparams(), bit_depth=bit_depth)) for bit_depth in (8, 16)])
+  print('  16-bit vs. 8-bit mode output PSNR, of an 8-bit frame: %.1f dB' % psnr)
+
+  # The clip limit has to change the 16-bit histeq_clahe output, as it does the 8-bit one:
+  clip_outputs = [histeq_clahe(img, clip_limit=clip_limit) for clip_limit in (1., 2., 4.)]
+  clip_effect = all(not np.array_equal(clip_outputs[0], res) for res in clip_outputs[1:])
+  print('  16-bit histeq_clahe output depends on the clip limit (1, 2, 4): %s' % verdict('bit_depth clip limit', clip_effect))
+
+  results['widened'] = widened
+  results['psnr'] = psnr
+  results['clip_effect'] = clip_effect
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def sharpening_reference(img):
+  """ Former sharpening implementation, a new kernel per call (for the sharpening benchmark) """
+
+  import cv2
+
+  kernel = np.array([[0, -1, 0],
+                     [-1, 5,-1],
+                     [0, -1, 0]])
+
+  return cv2.filter2D(src=img, ddepth=-1, kernel=kernel)
+
+def bench_sharpening(args):
+  """ sharpening methods vs. the former implementation, and the Lightness only sharpening (its added work within
+      histeq_clahe being the sharpening of a single plane) """
+
+  import cv2
+  from image_enhancement import sharpening
+
+  img = synthetic_frame(args.height, args.width)
+  dst = np.empty_like(img)
+  l_plane = cv2.extractChannel(cv2.cvtColor(img, cv2.COLOR_BGR2LAB), 0)
+  l_dst = np.empty_like(l_plane)
+
+  exact = np.array_equal(sharpening(img), sharpening_reference(img))
+
+  results = {
+    'former': timeit(lambda: sharpening_reference(img), args.repeat),
+    'kernel': timeit(lambda: sharpening(img, dst), args.repeat),
+    'unsharp': timeit(lambda: sharpening(img, dst, 'unsharp'), args.repeat),
+    'lightness': timeit(lambda: sharpening(l_plane, l_dst), args.repeat),
+    'lightness_unsharp': timeit(lambda: sharpening(l_plane, l_dst, 'unsharp'), args.repeat),
+  }
+
+  for name, t in results.items():
+    print('  %-18s %.4f sec (x%.2f vs. former)' % (name, t, results['former'] / t))
+  print('  kernel identical to former: %s' % verdict('sharpening', exact))
+  results['exact'] = exact
+
+  return results
+
+# -----------------------------------------------------------------------
+
+def run_metadata():
+  """ Identifies the code version and environment of a benchmarks run """
+
+  proc = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                        cwd=path.dirname(path.abspath(__file__)))
+
+  import cv2
+
+  return {
+    'version': proc.stdout.strip() if proc.returncode == 0 else None,
+    'date': datetime.now().isoformat(timespec='seconds'),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'opencv': cv2.__version__,
+    'machine': platform.machine(),
+    'processor': platform.processor(),
+  }
+
+# -----------------------------------------------------------------------
+
+benchmarks = {
+  'startup': bench_startup,
+  'lab': bench_lab,
+  'colorize': bench_colorize,
+  'arena': bench_arena,
+  'nl_tiles': bench_nl_tiles,
+  'brisque': bench_brisque,
+  'sweep': bench_sweep,
+  'io': bench_io,
+  'demosaic': bench_demosaic,
+  'bit_depth': bench_bit_depth,
+  'sharpening': bench_sharpening,
+  'suite': bench_suite,
+}
+
+def main(argv=None):
+
+  parser = argparse.ArgumentParser(description='Image Enhancement - benchmarks')
+  parser.add_argument('names', nargs='*', default=list(benchmarks.keys()), help='benchmarks to run: %s' % ', '.join(benchmarks.keys()))
+  parser.add_argument('--height', type=int, default=3000, help='synthetic frame height')
+  parser.add_argument('--width', type=int, default=4000, help='synthetic frame width')
+  parser.add_argument('--lab-min-psnr', type=float, default=30., help='lab: min PSNR of fused vs. two-step outputs')
+  parser.add_argument('--tile-size', type=int, default=512, help='nl_tiles: tile size')
+  parser.add_argument('--brisque-tolerance', type=float, default=0.01, help='brisque: max abs scores diff vs. imquality')
+  parser.add_argument('--sweep', action='append', default=None, metavar='KEY=VALUES', help='sweep: grid (default: nl_denoise_h=0:31:10, saturation=1.0,1.2)')
+  parser.add_argument('--resolutions', default='480x640,1536x2048,3000x4000', help='suite: comma separated HxW list')
+  parser.add_argument('--bits', default='8,16', help='suite: comma separated bit depths')
+  parser.add_argument('--data-dir', default=None, help='suite: synthetic TIFFs directory (default: under the temp dir)')
+  parser.add_argument('--repeat', type=int, default=5, help='number of repetitions, best one is reported')
+  parser.add_argument('--save', default=None, help='save results (+ version metadata) into a JSON file')
+  parser.add_argument('--compare', default=None, help='suite: baseline JSON file (from --save) to check regressions against')
+  parser.add_argument('--tolerance', type=float, default=0.1, help='suite: relative slowdown reported as a regression')
+  args = parser.parse_args(argv)
+  args.sweep = args.sweep or ['nl_denoise_h=0:31:10', 'saturation=1.0,1.2']
+
+  results = {}
+  for name in args.names:
+    print('Benchmark: %s' % name)
+    results[name] = benchmarks[name](args)
+
+  if args.save is not None:
+    with open(args.save, 'w') as f:
+      json.dump({'meta': run_metadata(), 'results': results}, f, indent=2, default=float)
+    print('Results saved: %s' % args.save)
+
+  regressions = []
+  if args.compare is not None and 'suite' in results:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    print('Comparison vs. %s (%s):' % (args.compare, baseline['meta'].get('version')))
+    regressions = compare_suite(results['suite'], baseline['results'].get('suite', {}), args.tolerance)
+    print('%d regressions' % len(regressions))
+
+  if failed_checks:
+    print('%d failed checks: %s' % (len(failed_checks), ', '.join(failed_checks)))
+
+  return 1 if regressions or failed_checks else 0
+
+# -----------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+  sys.exit(main())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import cv2
+import math
+import pickle
+import numpy as np
+from os import path
+from functools import lru_cache
+from importlib.util import find_spec
+
+# -----------------------------------------------------------------------
+# Native BRISQUE (no-reference Image Quality Assessment), a vectorized re-implementation of imquality.brisque:
+# same features (AGGD fits of the MSCN coefficients and of their 4 pairwise products, on 2 scales), same
+# normalization and same epsilon-SVR model, which are read from the imquality package data once and kept
+# in memory. The AGGD shape parameter is read from a precomputed lookup table instead of a numerical root finding.
+# -----------------------------------------------------------------------
+
+# AGGD shape parameter (alpha) lookup table range and resolution:
+aggd_alpha_range = (0.2, 10.0)
+aggd_alpha_step = 1e-4
+
+# -----------------------------------------------------------------------
+
+def imquality_models_dir():
+  """ imquality models directory, located without importing imquality itself (which pulls scikit-image and libsvm) """
+
+  spec = find_spec('imquality')
+  if spec is None:
+    raise ImportError('imquality package is required for its BRISQUE model files')
+
+  return path.join(list(spec.submodule_search_locations)[0], 'models')
+
+# -----------------------------------------------------------------------
+
+class BrisqueModel(object):
+  """ BRISQUE features normalization + epsilon-SVR with RBF kernel, parsed from the libsvm text model """
+
+  def __init__(self, models_dir=None):
+
+    models_dir = models_dir or imquality_models_dir()
+
+    with open(path.join(models_dir, 'normalize.pickle'), 'rb') as f:
+      scale_parameters = pickle.load(f)
+    self.scale_min = np.array(scale_parameters['min_'])
+    self.scale_max = np.array(scale_parameters['max_'])
+
+    header = {}
+    coefs, support_vectors = [], []
+    with open(path.join(models_dir, 'brisque_svm.txt')) as f:
+      for line in f:
+        if line.strip() == 'SV':
+          break
+        key, value = line.split(None, 1)
+        header[key] = value.strip()
+      for line in f:
+        tokens = line.split()
+        coefs.append(float(tokens[0]))
+        support_vectors.append([float(t.split(':')[1]) for t in tokens[1:]])
+
+    if header['svm_type'] != 'epsilon_svr' or header['kernel_type'] != 'rbf':
+      raise ValueError('Unsupported BRISQUE model: %s, %s' % (header['svm_type'], header['kernel_type']))
+
+    self.gamma = float(header['gamma'])
+    self.rho = float(header['rho'])
+    self.coefs = np.array(coefs)
+    self.support_vectors = np.array(support_vectors)
+    self.sv_sqnorm = np.square(self.support_vectors).sum(axis=1)
+
+  def scale(self, features):
+    return -1 + (2.0 / (self.scale_max - self.scale_min) * (features - self.scale_min))
+
+  def predict(self, scaled_features):
+    """ SVR decision values for a (N, 36) array of scaled features """
+
+    x = np.atleast_2d(scaled_features)
+    dist = np.square(x).sum(axis=1)[:,None] + self.sv_sqnorm[None,:] - 2 * x @ self.support_vectors.T
+    kernel = np.exp(-self.gamma * np.maximum(dist, 0))
+
+    return kernel @ self.coefs - self.rho
+
+@lru_cache(maxsize=4)
+def brisque_model(models_dir=None):
+  """ BrisqueModel, loaded once per models directory """
+
+  return BrisqueModel(models_dir)
+
+# -----------------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def aggd_alpha_table():
+  """ (phi(alpha), alpha) lookup table, phi(a) = G(2/a)**2 / (G(1/a)*G(3/a)) being increasing with alpha """
+
+  alpha = np.arange(aggd_alpha_range[0], aggd_alpha_range[1] + aggd_alpha_step, aggd_alpha_step)
+  lgamma = np.vectorize(math.lgamma)
+  phi = np.exp(2 * lgamma(2 / alpha) - lgamma(1 / alpha) - lgamma(3 / alpha))
+
+  return phi, alpha
+
+def aggd_fit(x):
+  """ Asymmetric Generalized Gaussian fit by moments matching, returns (alpha, mean, sigma_left**2, sigma_right**2) """
+
+  x = x.ravel()
+  sq = np.square(x)
+  left = x < 0
+  n_left = np.count_nonzero(left)
+
+  sq_sum = sq.sum()
+  sq_left = sq[left].sum()
+  sigma_left_sq = sq_left / n_left if n_left else np.nan
+  sigma_right_sq = (sq_sum - sq_left) / (x.size - n_left) if x.size > n_left else np.nan
+  gamma = math.sqrt(sigma_left_sq / sigma_right_sq)
+
+  r_hat = np.abs(x).mean() ** 2 / (sq_sum / x.size)
+  R_hat = r_hat * (gamma ** 3 + 1) * (gamma + 1) / (gamma ** 2 + 1) ** 2
+
+  phi, alphas = aggd_alpha_table()
+  alpha = float(np.interp(R_hat, phi, alphas))
+
+  constant = math.sqrt(math.gamma(1 / alpha) / math.gamma(3 / alpha))
+  mean = (math.sqrt(sigma_right_sq) - math.sqrt(sigma_left_sq)) * constant * math.gamma(2 / alpha) / math.gamma(1 / alpha)
+
+  return alpha, mean, sigma_left_sq, sigma_right_sq
+
+# -----------------------------------------------------------------------
+
+@lru_cache(maxsize=4)
+def gaussian_kernel1d(kernel_size, sigma):
+  """ Separable factor of imquality's normalized 2D gaussian kernel """
+
+  x = np.arange(kernel_size) - int(kernel_size / 2)
+  kernel = np.exp(-x ** 2 / (2 * sigma ** 2))
+
+  return kernel / kernel.sum()
+
+def mscn(gray, kernel_size=7, sigma=7/6):
+  """ Mean Subtracted Contrast Normalized coefficients (zero-padded 'same' gaussian filtering) """
+
+  kernel = gaussian_kernel1d(kernel_size, sigma)
+  blur = lambda img: cv2.sepFilter2D(img, cv2.CV_64F, kernel, kernel, borderType=cv2.BORDER_CONSTANT)
+
+  local_mean = blur(gray)
+  local_deviation = np.sqrt(np.abs(np.square(local_mean) - blur(np.square(gray))))
+
+  return (gray - local_mean) / (local_deviation + 1 / 255)
+
+def scale_features(gray, kernel_size=7, sigma=7/6):
+  """ 18 BRISQUE features of a single scale """
+
+  coefs = mscn(gray, kernel_size, sigma)
+
+  alpha, _, sigma_left_sq, sigma_right_sq = aggd_fit(coefs)
+  features = [alpha, (sigma_left_sq + sigma_right_sq) / 2]
+
+  for pairs in (coefs[:,:-1] * coefs[:,1:],       # horizontal
+                coefs[:-1,:] * coefs[1:,:],       # vertical
+                coefs[:-1,:-1] * coefs[1:,1:],    # main diagonal
+                coefs[1:,:-1] * coefs[:-1,1:]):   # secondary diagonal
+    features.extend(aggd_fit(pairs))
+
+  return features
+
+def downscale_half(gray):
+  """ Half-size image, as scikit-image 0.18 rescale(1/2, order=2, mode='constant', anti_aliasing=False) """
+
+  from scipy import ndimage
+
+  out_shape = np.round(0.5 * np.array(gray.shape)).astype(int)
+  factors = np.array(gray.shape, dtype=float) / out_shape
+  rows = factors[0] * (np.arange(out_shape[0]) + 0.5) - 0.5
+  cols = factors[1] * (np.arange(out_shape[1]) + 0.5) - 0.5
+  coords = np.array(np.meshgrid(rows, cols, indexing='ij'))
+
+  res = ndimage.map_coordinates(gray, coords, order=2, mode='constant', cval=0, prefilter=True)
+
+  min_val, max_val = gray.min(), gray.max()
+  zero_mask = res == 0 if not (min_val <= 0 <= max_val) else None
+  np.clip(res, min_val, max_val, out=res)
+  if zero_mask is not None:
+    res[zero_mask] = 0
+
+  return res
+
+def brisque_features(img, kernel_size=7, sigma=7/6, model=None):
+  """ 36 scaled BRISQUE features of a 3-channels uint8 image (channels weighted as RGB, like imquality) or a gray image """
+
+  model = model or brisque_model()
+
+  if len(img.shape) == 3:
+    gray = (img[:,:,:3] / 255.) @ np.array([0.2125, 0.7154, 0.0721])
+    gray_float = gray
+  else:
+    # imquality quirk: a 2D image keeps its range on the full scale, while the half scale is taken from [0,1] values
+    gray = img.astype(np.float64)
+    gray_float = gray / 255. if img.dtype == np.uint8 else gray
+
+  features = scale_features(gray, kernel_size, sigma) + scale_features(downscale_half(gray_float), kernel_size, sigma)
+
+  return model.scale(np.array(features))
+
+# -----------------------------------------------------------------------
+
+def brisque_score(img, kernel_size=7, sigma=7/6):
+  """ BRISQUE score of a single image (lower=better) """
+
+  return brisque_score_batch([img], kernel_size, sigma)[0]
+
+def brisque_score_batch(imgs, kernel_size=7, sigma=7/6):
+  """ BRISQUE scores of many images, with a single SVR evaluation over all of them """
+
+  model = brisque_model()
+  features = np.array([brisque_features(img, kernel_size, sigma, model) for img in imgs])
+
+  return model.predict(features)
@@ -1,221 +1,92 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
 import cv2
-import colorsys
+import sys
+import argparse
 import numpy as np
-import tensorflow as tf
 from pathlib import Path
 from os import path, makedirs
-import matplotlib.pyplot as plt
-from warnings import simplefilter
-from PIL import Image, ImageEnhance
-import imquality.brisque as brisque
-from tensorflow.python.ops.numpy_ops import np_config
-print('OpenCV version: %s' % cv2.__version__)
-print('Tensorflow version: %s' % tf.__version__)
-
-# ignore all future warnings
-simplefilter(action='ignore', category=FutureWarning)
+from image_enhancement import demosaic, iqa_score, image_enhance_defparams
+from image_enhancement_io import read_bayer
+from image_enhancement_sweep import SweepEngine, parse_sweep
+from image_enhancement_iqa_cache import IqaScoreCache, print_iqa_cache_stats, demosaic_variant
 
-data_dir = '/Users/shahargino/data/tracxpoint__data'
-img_files_list = [str(x) for x in Path(data_dir).rglob('*.tif')]
-print('%d images found' % len(img_files_list))
+default_data_dir = '/Users/shahargino/data/tracxpoint__data'
+default_results_dir = 'results'
 
 # -----------------------------------------------------------------------
 
-def histeq(img):
-  """ Apply Image Eualization to the converted image in LAB format to
-      only Lightness component and convert back the image to RGB """
+def parse_zoom(text):
+  """ 'y0:y1,x0:x1' --> function cropping that region of an image """
 
-  # Color input:
-  if len(img.shape) == 3:
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    lab_planes = list(cv2.split(lab))
-    lab_planes[0] = cv2.equalizeHist(lab_planes[0])
-    lab = cv2.merge(lab_planes)
-    res = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-  
-  # Gray input:
-  else:
-    res = cv2.equalizeHist(img.astype(np.uint8))
-
-  return res
-
-# -----------------------------------------------------------------------
+  (y0, y1), (x0, x1) = [[int(v) for v in rng.split(':')] for rng in text.split(',')]
 
-def clahe(img, grid_size=(8,8)):
-  """ Apply CLAHE to the converted image in LAB format to 
-      only Lightness component and convert back the image to RGB """
-  
-  clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=grid_size)
-  
-  # Color input:
-  if len(img.shape) == 3:
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    lab_planes = list(cv2.split(lab))
-    lab_planes[0] = clahe.apply(lab_planes[0])
-    lab = cv2.merge(lab_planes)
-    res = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-
-  # Gray input:
-  else:
-    res = clahe.apply(img)
-
-  return res
+  return lambda img: img[y0:y1,x0:x1]
 
 # -----------------------------------------------------------------------
 
-def gamma_correction(img, gamma=0.001):
-  """ Apply Gamma Correction, so that Out = MaxVal*(In/MaxVal)**(1/gamma)"""
+def main(argv=None):
 
-  max_val = np.iinfo(img.dtype).max
-
-  invGamma = 1 / gamma
-
-  table = [np.clip(pow(k/max_val, invGamma) * max_val, 0, max_val) for k in range(max_val+1)]
-  table = np.array(table, img.dtype)
-
-  if img.dtype == np.uint8:
-    res = cv2.LUT(img, table)
-  
-  else:
-    res = tf.image.adjust_gamma(img/max_val, gamma=gamma, gain=max_val).numpy()
-
-  return res
-
-# -----------------------------------------------------------------------
+  parser = argparse.ArgumentParser(description='Image Enhancement - parameters exploration')
+  parser.add_argument('-i', '--input', default=default_data_dir, help='input directory, scanned recursively')
+  parser.add_argument('-o', '--output', default=default_results_dir, help='output (results) directory')
+  parser.add_argument('--pattern', default='*25_0_1636473372301969.tif', help='input files glob pattern')
+  parser.add_argument('--sweep', action='append', default=None, metavar='KEY=VALUES',
+                      help="image_enhance_defparams key and values, as 'v1,v2,...' or 'start:stop:step' (repeatable, default: nl_denoise_h=0:31:2)")
+  parser.add_argument('--zoom', default='1800:2200,2000:2200', help="saved region 'y0:y1,x0:x1'")
+  parser.add_argument('-j', '--workers', type=int, default=0, help='threads running independent stages (default: all cores)')
+  args = parser.parse_args(argv)
 
-def colorize(image, hue):
-  """ Colorize PIL image `original` with the given `hue` (hue within 0-360), returns another PIL image """
+  print('Started')
 
-  def shift_hue(arr, hout):
-    rgb_to_hsv = np.vectorize(colorsys.rgb_to_hsv)
-    hsv_to_rgb = np.vectorize(colorsys.hsv_to_rgb)
+  print('OpenCV version: %s' % cv2.__version__)
 
-    r, g, b, a = np.rollaxis(arr, axis=-1)
-    h, s, v = rgb_to_hsv(r, g, b)
-    h = hout
-    r, g, b = hsv_to_rgb(h, s, v)
-    arr = np.dstack((r, g, b, a))
-    return arr
+  img_files_list = sorted(str(x) for x in Path(args.input).rglob(args.pattern))
+  print('%d images found' % len(img_files_list))
 
-  img = image.convert('RGBA')
-  arr = np.array(np.asarray(img).astype('float'))
-  res = Image.fromarray(shift_hue(arr, hue/360.).astype('uint8'), 'RGBA')
+  grid = dict(parse_sweep(text) for text in (args.sweep or ['nl_denoise_h=0:31:2']))
+  zoom_in = parse_zoom(args.zoom)
+  params = image_enhance_defparams()
 
-  return res
-
-# -----------------------------------------------------------------------
-
-def saturation(img, saturation_factor=1.1):
-  """ Image Saturation, based on PIL library """
-
-  pil_img = Image.fromarray(img)
-  res = np.array(ImageEnhance.Color(pil_img).enhance(saturation_factor))
-
-  return res
-
-# -----------------------------------------------------------------------
-
-def sharpening(img):
-  """ Image sharpening by a kernel operation """
-  
-  kernel = np.array([[0, -1, 0],
-                     [-1, 5,-1],
-                     [0, -1, 0]])
-  
-  res = cv2.filter2D(src=img, ddepth=-1, kernel=kernel)
-
-  return res
-
-# -----------------------------------------------------------------------
+  # Input scores are unchanged across runs, only the sweep outputs are scored each time:
+  score_cache = IqaScoreCache()
 
-def denoise(img, mode='bilateral', median_kernel=11, d=9, sigmaColor=75, sigmaSpace=75):
-  """ Applies the bilateral filter to an image, highly effective in noise removal while keeping edges sharp """
+  for k, img_file in enumerate(img_files_list):
 
-  if mode == 'median':
-    res = cv2.medianBlur(img, median_kernel)
-  
-  elif mode == 'bilateral':
-    res = cv2.bilateralFilter(img, d, sigmaColor, sigmaSpace)
-
-  else:
-    res = img.copy()
-
-  return res
-
-# -----------------------------------------------------------------------
-
-def nl_denoise(img, h=10, template_win=7, search_win=21, temporal_index=2, temporal_window=3):
-  """ Non-local Means Denoising algorithm to remove noise in the image
-      If img is a list of images, then temporal information will be exploit.
-      For example, if img is a list of 5 frames, and temporal_index=2 and 
-      temopral_window=3 then frame-1, frame-2 and frame-3 are used to denoise frame-2 """
-
-  if type(img) == list:
-    res = cv2.fastNlMeansDenoisingColoredMulti(img, temporal_index, temporal_window, None, h, h, template_win, search_win)
-
-  else:
-    res = cv2.fastNlMeansDenoisingColored(img, None, h, h, template_win, search_win)
-
-  return res
-
-# -----------------------------------------------------------------------
-
-def iqa_score(img, resize=(380, 507)):
-  """ Image Quality Assessment with no-reference, return the BRISQUE score """
-  
-  resized_img = cv2.resize(img, resize)
-  iqa_score = brisque.score(resized_img)
-
-  return iqa_score
-
-# -----------------------------------------------------------------------
-
-def image_enhance(img, gamma=0.001, sat=1.1, denoise_h=10):
-  """ Gamma Correction + Histogram Equalization + CLAHE + Local Denoise + Sharpening + NonLocal Denoise + Saturation """
-
-  gamma_img = gamma_correction(img, gamma)
-  histeq_img = histeq(gamma_img.astype(np.uint8))
-  clahe_img = clahe(histeq_img)
-  #denoise_img = denoise(clahe_img)  
-  nl_denoise_img = nl_denoise(clahe_img, denoise_h)
-  sharp_img = sharpening(nl_denoise_img)
-  sat_img = saturation(sharp_img, sat)
-
-  return sat_img
-
-# -----------------------------------------------------------------------
-
-print('Started')
+    print('Processing (%d/%d): %s' % (k+1, len(img_files_list), img_file))
 
-#zoom_in = lambda img: img[800:2200,1500:2200,:]
-zoom_in = lambda img: img[1800:2200,2000:2200,:]
+    bayer_img = np.ascontiguousarray(read_bayer(img_file))
 
-for k, img_file in enumerate(img_files_list):
+    # The input is scored as demosaiced by the default parameters, the sweep may cover the demosaic parameters as well:
+    tif_score = score_cache.score(img_file, lambda: demosaic(bayer_img, params['demosaic_pattern'], params['demosaic_algorithm']).astype(np.uint8),
+                                  iqa_score, variant=demosaic_variant(params))
 
-  if img_file.endswith('25_0_1636473372301969.tif'):
+    engine = SweepEngine(bayer_img, args.workers)
+    results = engine.sweep(grid, params)
 
-    print('Processing (%d/%d): %s' % (k+1, len(img_files_list), img_file))
+    for res in results:
 
-    bayer_img = cv2.imread(img_file, cv2.IMREAD_UNCHANGED)
-    tif_img = cv2.cvtColor(bayer_img, cv2.COLOR_BAYER_BG2BGR)
-      
-    tif_score = iqa_score(tif_img.astype(np.uint8))
+      setting = '_'.join('%s%s' % (key, res['params'][key]) for key in grid)
+      print('%s --> %.2f' % (setting, res['score']))
 
-    for h in range(0,31,2):
+      out_file = path.join(args.output, path.relpath(img_file, args.input))
+      out_file = out_file.replace('.tif', '_%s_iqa_%.2f_to_%.2f.tif' % (setting, tif_score, res['score']))
+      makedirs(path.dirname(out_file), exist_ok=True)
+      cv2.imwrite(out_file, zoom_in(res['image']))
 
-      res_img = image_enhance(tif_img, gamma=0.001, sat=1.1, denoise_h=h)
+    print('Sweep: %d combinations, %d stages computed (%d without sharing)' %
+          (len(results), engine.stats()['stage_runs'], len(results) * len(engine.stages)))
 
-      res_score = iqa_score(res_img)
-      
-      print("h=%d --> %.2f" % (h, res_score))
+  print_iqa_cache_stats(score_cache.stats())
+  score_cache.close()
 
-      out_file = img_file.replace(data_dir, 'results').replace('.tif', '_h%d_iqa_%.2f_to_%.2f.tif' % (h, tif_score, res_score))
-      out_dir = path.dirname(out_file)
-      if not path.exists(out_dir):
-        makedirs(out_dir)
-      cv2.imwrite(out_file, zoom_in(res_img))
+  print('completed successfully')
 
 # -----------------------------------------------------------------------
 
-print('completed successfully')
+if __name__ == "__main__":
 
+  sys.exit(main())
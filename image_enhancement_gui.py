@@ -4,15 +4,272 @@
 # All rights reserved
 
 import sys
+import math
 import numpy as np
-import cv2, imutils
-from os import environ
+from collections import OrderedDict
+import cv2
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QFileDialog
 from PyQt5.QtGui import QImage, QPalette 
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
-environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # supress tensorflow messages 
-from image_enhancement import image_enhance, image_enhance_defparams, iqa_score
+from image_enhancement import demosaic, image_enhance_defparams, iqa_score
+from image_enhancement_profiler import StageProfiler, CancellableProfiler, RenderCancelled
+from image_enhancement_sweep import SweepEngine
+from image_enhancement_io import read_bayer
+
+# Preview (proxy) resolution, longest side of the image enhanced first on launch, for immediate feedback:
+preview_max_side = 640
+
+# Memory bound of the per-stage intermediate images kept for the loaded image (and its proxy, 1/8 of it):
+stage_cache_bytes = 2**30
+
+# Viewer tiles size, and memory bound of the rendered tiles (pixmaps) cache:
+tile_size = 256
+tile_cache_bytes = 2**28
+
+
+def proxy_image(image, max_side=preview_max_side):
+    """ Image downscaled (area interpolation) so that its longest side is at most max_side """
+    scale = float(max_side) / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+class TileView(QtWidgets.QWidget):
+    """ Image viewer widget (within a QScrollArea), painting only the visible tiles of a multi-resolution pyramid.
+        Level k is the image downscaled by 2**k, built lazily from level k-1, and the level drawn is the smallest
+        one still at or above the display resolution. Tiles are converted into pixmaps on first paint and kept in
+        an LRU cache, so pan/zoom cost scales with the viewport rather than with the image.
+        The image is stretched over the widget, so a preview (proxy) image is drawn over the full image area """
+
+    def __init__(self, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.tiles = OrderedDict()
+        self.tiles_bytes = 0
+        self.levels = []
+
+    def setImage(self, image):
+        self.levels = [image]
+        self.tiles.clear()
+        self.tiles_bytes = 0
+        self.update()
+
+    def level(self, k):
+        while len(self.levels) <= k:
+            prev = self.levels[-1]
+            self.levels.append(cv2.resize(prev, ((prev.shape[1] + 1) // 2, (prev.shape[0] + 1) // 2), interpolation=cv2.INTER_AREA))
+        return self.levels[k]
+
+    def tile(self, k, tx, ty):
+        key = (k, tx, ty)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        img = self.level(k)[ty * tile_size:(ty + 1) * tile_size, tx * tile_size:(tx + 1) * tile_size]
+        frame = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        pixmap = QtGui.QPixmap.fromImage(QImage(frame, frame.shape[1], frame.shape[0], frame.strides[0], QImage.Format_RGB888))
+        self.tiles[key] = pixmap
+        self.tiles_bytes += frame.nbytes
+        while self.tiles_bytes > tile_cache_bytes and len(self.tiles) > 1:
+            old = self.tiles.popitem(last=False)[1]
+            self.tiles_bytes -= 3 * old.width() * old.height()
+        return pixmap
+
+    def paintEvent(self, event):
+        if not self.levels or self.width() == 0 or self.height() == 0:
+            return
+        image = self.levels[0]
+        sx, sy = float(self.width()) / image.shape[1], float(self.height()) / image.shape[0]
+        k = 0
+        while max(sx, sy) * 2**(k + 1) <= 1 and min(self.level(k).shape[:2]) > tile_size:
+            k += 1
+        level_img = self.level(k)
+        sx, sy = float(self.width()) / level_img.shape[1], float(self.height()) / level_img.shape[0]
+
+        rect = event.rect()
+        tx0, tx1 = int(rect.left() / sx) // tile_size, min(int(math.ceil((rect.right() + 1) / sx)), level_img.shape[1] - 1) // tile_size
+        ty0, ty1 = int(rect.top() / sy) // tile_size, min(int(math.ceil((rect.bottom() + 1) / sy)), level_img.shape[0] - 1) // tile_size
+
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                pixmap = self.tile(k, tx, ty)
+                target = QtCore.QRectF(tx * tile_size * sx, ty * tile_size * sy, pixmap.width() * sx, pixmap.height() * sy)
+                painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+        painter.end()
+
+    def pixmap(self):
+        """ Full resolution pixmap of the image (e.g. for printing) """
+        frame = cv2.cvtColor(self.levels[0], cv2.COLOR_BGR2RGB)
+        return QtGui.QPixmap.fromImage(QImage(frame, frame.shape[1], frame.shape[0], frame.strides[0], QImage.Format_RGB888))
+
+
+class JobSignals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(object, int, str)
+    partial = QtCore.pyqtSignal(object, object)
+    done = QtCore.pyqtSignal(object, object)
+    failed = QtCore.pyqtSignal(object, str)
+    finished = QtCore.pyqtSignal(object)
+
+
+class Job(QtCore.QRunnable):
+    """ A Worker job: func(job, *args) runs on a QThreadPool thread, and may call job.progress(percent, text)
+        and job.partial(result) (e.g. a preview). Its result, error and completion are signaled to the Worker.
+        cancel() flags the job (func polls job.cancelled) and cancels its profiler, if any """
+
+    def __init__(self, kind, func, *args):
+        QtCore.QRunnable.__init__(self)
+        self.setAutoDelete(False)
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.cancelled = False
+        self.profiler = None
+        self.signals = JobSignals()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.profiler is not None:
+            self.profiler.cancel()
+
+    def progress(self, percent, text):
+        self.signals.progress.emit(self, percent, text)
+
+    def partial(self, result):
+        self.signals.partial.emit(self, result)
+
+    def run(self):
+        try:
+            if not self.cancelled:
+                self.signals.done.emit(self, self.func(self, *self.args))
+        except RenderCancelled:
+            pass
+        except Exception as e:
+            self.signals.failed.emit(self, '%s: %s' % (type(e).__name__, str(e)))
+        self.signals.finished.emit(self)
+
+
+class Worker(QtCore.QObject):
+    """ Background jobs runner, keeping the GUI thread for display only.
+        Jobs of the same kind (e.g. 'enhance') run one at a time, and are coalesced: submitting a job cancels the
+        running one of its kind and replaces the waiting one, so only the latest request is processed. Signals of
+        stale (cancelled or superseded) jobs are dropped, the others are re-emitted as (kind, ...) on the GUI thread """
+
+    progress = QtCore.pyqtSignal(str, int, str)
+    partial = QtCore.pyqtSignal(str, object)
+    done = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, str)
+    idle = QtCore.pyqtSignal()
+
+    def __init__(self, pool=None):
+        QtCore.QObject.__init__(self)
+        # A private pool (one thread per job kind): Qt itself uses the global one, e.g. for smooth pixmap scaling,
+        # which would otherwise wait behind long enhance jobs
+        if pool is None:
+            pool = QtCore.QThreadPool()
+            pool.setMaxThreadCount(3)
+        self.pool = pool
+        self.running = {}
+        self.pending = {}
+
+    def submit(self, kind, func, *args):
+        job = Job(kind, func, *args)
+        job.signals.progress.connect(self.jobProgress)
+        job.signals.partial.connect(self.jobPartial)
+        job.signals.done.connect(self.jobDone)
+        job.signals.failed.connect(self.jobFailed)
+        job.signals.finished.connect(self.jobFinished)
+        if kind in self.running:
+            self.running[kind].cancel()
+            self.pending[kind] = job
+        else:
+            self.start(job)
+
+    def start(self, job):
+        self.running[job.kind] = job
+        self.pool.start(job)
+
+    def cancel(self, kind=None):
+        for k in ([kind] if kind is not None else list(self.running.keys())):
+            self.pending.pop(k, None)
+            if k in self.running:
+                self.running[k].cancel()
+
+    def isCurrent(self, job):
+        return not job.cancelled and self.running.get(job.kind) is job and job.kind not in self.pending
+
+    def isBusy(self):
+        return bool(self.running)
+
+    @QtCore.pyqtSlot(object, int, str)
+    def jobProgress(self, job, percent, text):
+        if self.isCurrent(job):
+            self.progress.emit(job.kind, percent, text)
+
+    @QtCore.pyqtSlot(object, object)
+    def jobPartial(self, job, result):
+        if self.isCurrent(job):
+            self.partial.emit(job.kind, result)
+
+    @QtCore.pyqtSlot(object, object)
+    def jobDone(self, job, result):
+        if self.isCurrent(job):
+            self.done.emit(job.kind, result)
+
+    @QtCore.pyqtSlot(object, str)
+    def jobFailed(self, job, error):
+        if self.isCurrent(job):
+            self.failed.emit(job.kind, error)
+
+    @QtCore.pyqtSlot(object)
+    def jobFinished(self, job):
+        if self.running.get(job.kind) is job:
+            del self.running[job.kind]
+        if job.kind in self.pending:
+            self.start(self.pending.pop(job.kind))
+        if not self.running:
+            self.idle.emit()
+
+
+def bayer_proxy(bayer_img, pattern, max_side=preview_max_side):
+    """ Preview (proxy) image of a raw frame, from its half resolution (binning) demosaic """
+    return proxy_image(demosaic(bayer_img, pattern, 'binning'), max_side)
+
+
+def load_job(job, filename, params):
+    """ Reads and demosaics (by the demosaic params) a Bayer TIFF, returns (raw image, image, preview proxy) """
+    job.progress(0, 'Reading %s' % filename)
+    bayer_img = np.ascontiguousarray(read_bayer(filename))
+    job.progress(50, 'Demosaicing')
+    image = demosaic(bayer_img, params['demosaic_pattern'], params['demosaic_algorithm'])
+    return bayer_img, image, bayer_proxy(bayer_img, params['demosaic_pattern'])
+
+
+def enhance_job(job, engine, proxy_engine, params):
+    """ image_enhance of the proxy (if proxy_engine is not None, reported as a partial result) then of the full image,
+        returns (image, profiler). The engines (see image_enhancement_sweep) keep the intermediate image of every stage,
+        so only the stages depending on changed parameters, and the ones downstream, are computed """
+    runs = [('preview', proxy_engine), ('full resolution', engine)] if proxy_engine is not None else [('full resolution', engine)]
+    plans = [(name, stage) for name, run_engine in runs for stage in run_engine.plan(params)]
+    count = [0]
+    def on_stage(stage):
+        job.progress(100 * count[0] // len(plans), 'Enhancing %s: %s' % plans[min(count[0], len(plans) - 1)])
+        count[0] += 1
+    job.profiler = CancellableProfiler(on_stage=on_stage)
+    if job.cancelled:
+        raise RenderCancelled()
+    for name, run_engine in runs:
+        res_img = run_engine.run([params], job.profiler)[0]
+        if run_engine is proxy_engine:
+            job.partial(res_img)
+    return res_img, job.profiler
+
+
+def score_job(job, image):
+    job.progress(0, 'Scoring')
+    return iqa_score(image)
 
 
 class Ui_MainWindow(object):
@@ -37,13 +294,11 @@ class Ui_MainWindow(object):
         self.verticalLayout_3 = QtWidgets.QVBoxLayout()
         self.verticalLayout_3.setObjectName("verticalLayout_3")
         
-        # Image ("label"):
-        self.label = QtWidgets.QLabel(self.centralwidget)
-        self.label.setText("")
+        # Image ("label", a tiles viewer):
+        self.label = TileView(self.centralwidget)
         self.label.setObjectName("label")
         self.label.setBackgroundRole(QPalette.Base)
         self.label.setSizePolicy(QtWidgets.QSizePolicy.Ignored, QtWidgets.QSizePolicy.Ignored)
-        self.label.setScaledContents(True)        
        
         # Scroll Area:
         self.scrollArea = QtWidgets.QScrollArea()
@@ -108,6 +363,12 @@ class Ui_MainWindow(object):
         self.pushButton_3.setObjectName("pushButton_3")
         self.pushButton_3.hide()
         self.verticalLayout_2.addWidget(self.pushButton_3)
+
+        self.previewCheckBox = QtWidgets.QCheckBox(self.centralwidget)
+        self.previewCheckBox.setObjectName("previewCheckBox")
+        self.previewCheckBox.setChecked(True)
+        self.previewCheckBox.hide()
+        self.verticalLayout_2.addWidget(self.previewCheckBox)
         
         self.pushButton_4 = QtWidgets.QPushButton(self.centralwidget)
         self.pushButton_4.setObjectName("pushButton_4")
@@ -139,6 +400,17 @@ class Ui_MainWindow(object):
         self.statusbar.setObjectName("statusbar")
         MainWindow.setStatusBar(self.statusbar)
 
+        self.progressBar = QtWidgets.QProgressBar()
+        self.progressBar.setObjectName("progressBar")
+        self.progressBar.setMaximumWidth(150)
+        self.progressBar.hide()
+        self.statusbar.addPermanentWidget(self.progressBar)
+
+        self.cancelButton = QtWidgets.QPushButton()
+        self.cancelButton.setObjectName("cancelButton")
+        self.cancelButton.hide()
+        self.statusbar.addPermanentWidget(self.cancelButton)
+
         # Actions bind: 
         self.retranslateUi(MainWindow)
         self.pushButton.clicked.connect(self.savePhoto)
@@ -147,14 +419,25 @@ class Ui_MainWindow(object):
         self.pushButton_4.clicked.connect(self.toggle_params)
         self.pushButton_5.clicked.connect(self.image_quality)
         self.pushButton_6.clicked.connect(self.quit)
+        self.cancelButton.clicked.connect(self.cancel)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
         
         # Variables initialization:
         self.filename = None
         self.tmp_img = None
+        self.quiet_score = False
         self.params_en = False
         self.scaleFactor = 0.0
         self.printer = QPrinter()
+        self.profiler = StageProfiler(trace_memory=False)
+
+        # Background worker (enhance, load and score jobs):
+        self.worker = Worker()
+        self.worker.progress.connect(self.jobProgress)
+        self.worker.partial.connect(self.jobPartial)
+        self.worker.done.connect(self.jobDone)
+        self.worker.failed.connect(self.jobFailed)
+        self.worker.idle.connect(self.jobsIdle)
         
         # Actions and Menus
         self.createActions(MainWindow)
@@ -162,7 +445,7 @@ class Ui_MainWindow(object):
    
     # -----------------------------------------------------------------------------------------
 
-    def launch(self):
+    def readParams(self):
 
         params = {}
         for param_name in self.defparams.keys():
@@ -172,20 +455,85 @@ class Ui_MainWindow(object):
             elif params[param_name].replace('.','',1).isdigit():
                 params[param_name] = float(params[param_name])
 
-        res_img = image_enhance(self.image, params)
+        return params
+
+    # -----------------------------------------------------------------------------------------
+
+    def launch(self):
+        """ Enhances the image in the background: the proxy image first for an immediate preview (when enabled),
+            then the full resolution image. A launch still running is cancelled, and only the latest one is processed """
+
+        params = self.readParams()
+        preview = self.previewCheckBox.isChecked() and max(self.image.shape[:2]) > preview_max_side
+
+        if params['demosaic_pattern'] != self.proxy_pattern:
+            self.setProxy(params['demosaic_pattern'])
+
+        self.worker.submit('enhance', enhance_job, self.engine, self.proxy_engine if preview else None, params)
+
+    # -----------------------------------------------------------------------------------------
+
+    def cancel(self):
+        self.worker.cancel()
+        self.statusbar.showMessage('Cancelled')
+
+    # -----------------------------------------------------------------------------------------
+
+    def jobProgress(self, kind, percent, text):
+        self.progressBar.setValue(percent)
+        self.progressBar.show()
+        self.cancelButton.show()
+        self.statusbar.showMessage(text)
+
+    # -----------------------------------------------------------------------------------------
+
+    def jobPartial(self, kind, result):
+        if kind == 'enhance':
+            self.setPhoto(result, preview=True)
+
+    # -----------------------------------------------------------------------------------------
+
+    def jobDone(self, kind, result):
+        if kind == 'load':
+            self.imageLoaded(*result)
+        elif kind == 'enhance':
+            res_img, self.profiler = result
+            self.setPhoto(res_img)
+            self.showProfile()
+        elif kind == 'score':
+            self.statusbar.showMessage("Image Quality (lower=better): %.3f" % result)
+            if not self.quiet_score:
+                QtWidgets.QMessageBox.information(None, "Image Viewer", "Image Quality (lower=better): %.3f" % result)
 
-        self.setPhoto(res_img)
+    # -----------------------------------------------------------------------------------------
+
+    def jobFailed(self, kind, error):
+        self.statusbar.showMessage('%s failed: %s' % (kind, error))
+        if kind == 'load':
+            QtWidgets.QMessageBox.information(None, "Image Viewer", "Cannot load %s --> %s" % (self.filename, error))
+
+    # -----------------------------------------------------------------------------------------
+
+    def jobsIdle(self):
+        self.progressBar.hide()
+        self.cancelButton.hide()
+
+    # -----------------------------------------------------------------------------------------
+
+    def showProfile(self):
+        """ Shows the last launch stages timing on the status bar (stages reused from the cache are not listed) """
+        records = self.profiler.last_frame()
+        total = sum(r['wall'] for r in records)
+        stages = ', '.join('%s %.0fms' % (r['stage'], 1e3 * r['wall']) for r in records) or 'all stages cached'
+        self.statusbar.showMessage('Launch %.2f sec: %s' % (total, stages))
     
     # -----------------------------------------------------------------------------------------
 
     def image_quality(self, quiet=False):
-        
-        res_score = iqa_score(self.tmp_img)
-
-        if not quiet:
-            QtWidgets.QMessageBox.information(None, "Image Viewer", "Image Quality (lower=better): %.3f" % res_score)
+        """ Scores the displayed image in the background, the score is shown once ready (on the status bar only if quiet) """
 
-        return res_score
+        self.quiet_score = quiet
+        self.worker.submit('score', score_job, self.tmp_img)
 
     # -----------------------------------------------------------------------------------------
 
@@ -209,6 +557,7 @@ class Ui_MainWindow(object):
     # -----------------------------------------------------------------------------------------
 
     def quit(self):
+        self.worker.cancel()
         QtCore.QCoreApplication.instance().quit()
 
     # -----------------------------------------------------------------------------------------
@@ -219,39 +568,56 @@ class Ui_MainWindow(object):
         """
         self.filename = QFileDialog.getOpenFileName(filter="Image (*.tif)")[0]
         if self.filename:
-            bayer_img = cv2.imread(self.filename, cv2.IMREAD_UNCHANGED)
-            try:
-                self.image = cv2.cvtColor(bayer_img, cv2.COLOR_BAYER_BG2BGR)
-            except Exception as e:
-                QtWidgets.QMessageBox.information(None, "Image Viewer", "Cannot load %s --> %s" % (self.filename, str(e)))
-                return
-        
-        self.setPhoto(self.image)
+            self.worker.cancel('enhance')
+            self.worker.submit('load', load_job, self.filename, self.readParams())
+
+    # -----------------------------------------------------------------------------------------
+
+    def imageLoaded(self, bayer_img, image, proxy):
+        """ Displays a newly loaded image (see load_job). The stages engine runs on the raw image, demosaic included """
+        self.bayer_img = bayer_img
+        self.image = image
+        self.engine = SweepEngine(bayer_img, workers=1, max_cache_bytes=stage_cache_bytes)
+        self.setProxy(self.readParams()['demosaic_pattern'], proxy)
         self.scaleFactor = 1.0
+        self.setPhoto(self.image)
         self.scrollArea.setVisible(True)
         self.printAct.setEnabled(True)
         self.fitToWindowAct.setEnabled(True)
         self.updateActions()
-        if not self.fitToWindowAct.isChecked():
-            self.label.adjustSize()
         self.show_params()
         self.pushButton.show()
         self.pushButton_3.show()
+        self.previewCheckBox.show()
         self.pushButton_4.show()
         self.pushButton_5.show()
         
     # -----------------------------------------------------------------------------------------
+
+    def setProxy(self, pattern, proxy=None):
+        """ Preview (proxy) image and its stages engine, for a Bayer pattern (the proxy is built from the raw image if not given) """
+        self.proxy_pattern = pattern
+        self.proxy = bayer_proxy(self.bayer_img, pattern) if proxy is None else proxy
+        self.proxy_engine = SweepEngine(self.proxy, workers=1, max_cache_bytes=stage_cache_bytes // 8)
+
+    # -----------------------------------------------------------------------------------------
     
-    def setPhoto(self, image):
-        """ This function will take image input and resize it 
-            only for display purpose and convert it to QImage
-            to set at the label.
+    def setPhoto(self, image, preview=False):
+        """ This function will take image input and set it at the label,
+            which renders only the visible tiles at the display resolution.
+            A preview (proxy) image is stretched over the full image size, and is not kept for save/quality.
         """
-        self.tmp_img = image
-        #image = imutils.resize(image, width=640)
-        frame = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = QImage(frame, frame.shape[1],frame.shape[0], frame.strides[0], QImage.Format_RGB888)
-        self.label.setPixmap(QtGui.QPixmap.fromImage(image))
+        if not preview:
+            self.tmp_img = image
+        self.label.setImage(image)
+        if not self.fitToWindowAct.isChecked():
+            self.label.resize(self.scaleFactor * self.imageSize())
+
+    # -----------------------------------------------------------------------------------------
+
+    def imageSize(self):
+        """ Full resolution image size, whatever the displayed pixmap resolution is """
+        return QtCore.QSize(self.bayer_img.shape[1], self.bayer_img.shape[0])
     
     # -----------------------------------------------------------------------------------------
     
@@ -270,9 +636,11 @@ class Ui_MainWindow(object):
         self.pushButton.setText(_translate("MainWindow", "Save"))
         self.pushButton_2.setText(_translate("MainWindow", "Open"))
         self.pushButton_3.setText(_translate("MainWindow", "Launch"))
+        self.previewCheckBox.setText(_translate("MainWindow", "Preview"))
         self.pushButton_4.setText(_translate("MainWindow", "Toggle Params"))
         self.pushButton_5.setText(_translate("MainWindow", "Image Quality"))
         self.pushButton_6.setText(_translate("MainWindow", "Exit"))
+        self.cancelButton.setText(_translate("MainWindow", "Cancel"))
         for param_name in self.defparams.keys():
             label_obj_name = '%s_label' % param_name
             label_obj = getattr(self, label_obj_name)
@@ -285,11 +653,12 @@ class Ui_MainWindow(object):
         if dialog.exec_():
             painter = QPainter(self.printer)
             rect = painter.viewport()
-            size = self.label.pixmap().size()
+            pixmap = self.label.pixmap()
+            size = pixmap.size()
             size.scale(rect.size(), Qt.KeepAspectRatio)
             painter.setViewport(rect.x(), rect.y(), size.width(), size.height())
-            painter.setWindow(self.label.pixmap().rect())
-            painter.drawPixmap(0, 0, self.label.pixmap())
+            painter.setWindow(pixmap.rect())
+            painter.drawPixmap(0, 0, pixmap)
     
     # -----------------------------------------------------------------------------------------
 
@@ -304,7 +673,7 @@ class Ui_MainWindow(object):
     # -----------------------------------------------------------------------------------------
 
     def normalSize(self):
-        self.label.adjustSize()
+        self.label.resize(self.imageSize())
         self.scaleFactor = 1.0
     
     # -----------------------------------------------------------------------------------------
@@ -383,7 +752,7 @@ class Ui_MainWindow(object):
 
     def scaleImage(self, factor):
         self.scaleFactor *= factor
-        self.label.resize(self.scaleFactor * self.label.pixmap().size())
+        self.label.resize(self.scaleFactor * self.imageSize())
 
         self.adjustScrollBar(self.scrollArea.horizontalScrollBar(), factor)
         self.adjustScrollBar(self.scrollArea.verticalScrollBar(), factor)
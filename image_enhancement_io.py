@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import cv2
+from image_enhancement import demosaic
+from time import perf_counter
+from os import path, makedirs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# -----------------------------------------------------------------------
+# Bayer TIFF ingestion: uncompressed TIFFs are memory-mapped (tifffile), so only the pages of the rows actually used
+# are read from disk, and demosaicing runs directly from the mapped buffer. Other files fall back to cv2.imread.
+# Batch I/O helpers: frames prefetching and write-behind on background threads, with bounded queues.
+# -----------------------------------------------------------------------
+
+# Extra rows/columns demosaiced around a ROI, so that its pixels are identical to the ones of a full frame demosaic
+# (even, to keep the Bayer phase, and wide enough for the VNG neighborhoods):
+roi_margin = 8
+
+# The ROI window first column is a multiple of roi_align, since OpenCV's vectorized VNG output depends on the column
+# phase of the window (rows only need the even Bayer phase):
+roi_align = 16
+
+# -----------------------------------------------------------------------
+
+def map_bayer(filename):
+  """ Read-only memory map of an uncompressed, contiguous single-page TIFF, or None if it cannot be mapped """
+
+  try:
+    import tifffile
+  except ImportError:
+    return None
+
+  try:
+    return tifffile.memmap(filename, mode='r')
+  except (ValueError, OSError):
+    return None
+
+# -----------------------------------------------------------------------
+
+def read_bayer(filename, roi=None, mmap=True):
+  """ Raw (Bayer) frame of a TIFF, memory-mapped when possible (mmap=True), as a 2D array.
+      roi=(y0, y1, x0, x1) returns that region only, which for a mapped file reads only its rows """
+
+  bayer = map_bayer(filename) if mmap else None
+
+  if bayer is None:
+    bayer = cv2.imread(filename, cv2.IMREAD_UNCHANGED)
+    if bayer is None:
+      raise IOError('cannot read %s' % filename)
+
+  if roi is not None:
+    y0, y1, x0, x1 = roi
+    bayer = bayer[y0:y1,x0:x1]
+
+  return bayer
+
+# -----------------------------------------------------------------------
+
+def load_frame(filename, roi=None, mmap=True, pattern='BG', algorithm='bilinear'):
+  """ Demosaiced BGR frame of a Bayer TIFF (see read_bayer and image_enhancement.demosaic), optionally of a
+      roi=(y0, y1, x0, x1) only. The ROI is demosaiced within an aligned window with a margin (see roi_margin, roi_align),
+      so it equals the same region of a full frame demosaic, for every algorithm (binning returns the 2x2 cells covering the ROI, at half resolution) """
+
+  bayer = read_bayer(filename, mmap=mmap)
+
+  if roi is None:
+    return demosaic(bayer, pattern, algorithm)
+
+  height, width = bayer.shape[:2]
+  y0, y1, x0, x1 = max(roi[0], 0), min(roi[1], height), max(roi[2], 0), min(roi[3], width)
+
+  if algorithm == 'binning':
+    return demosaic(bayer[y0&~1:y1+(y1&1),x0&~1:x1+(x1&1)], pattern, algorithm)
+
+  # Bayer phase (even rows) and roi_align (columns) aligned window, with a margin:
+  wy0, wx0 = max(y0 - roi_margin, 0) & ~1, max(x0 - roi_margin, 0) // roi_align * roi_align
+  wy1, wx1 = min(y1 + roi_margin, height), min(x1 + roi_margin, width)
+
+  window = demosaic(bayer[wy0:wy1,wx0:wx1], pattern, algorithm)
+
+  return window[y0-wy0:y1-wy0,x0-wx0:x1-wx0]
+
+# -----------------------------------------------------------------------
+
+def prefetch(func, items, depth=2, workers=1):
+  """ Futures of func(item) for every item, in order, computed on background threads up to depth items ahead of the
+      consumer (which bounds the memory held by prefetched results). Pending items are cancelled if the consumer stops """
+
+  with ThreadPoolExecutor(workers) as executor:
+    pending = deque()
+    try:
+      for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) > depth:
+          yield pending.popleft()
+      while pending:
+        yield pending.popleft()
+    finally:
+      for job in pending:
+        job.cancel()
+
+# -----------------------------------------------------------------------
+
+def write_image(filename, img, known_dirs=None):
+  """ cv2.imwrite raising IOError on failure, creating the parent directory unless it is in known_dirs (a set of the
+      directories already created, updated). Returns the elapsed time """
+
+  t = perf_counter()
+
+  dirname = path.dirname(filename)
+  if dirname and (known_dirs is None or dirname not in known_dirs):
+    makedirs(dirname, exist_ok=True)
+    if known_dirs is not None:
+      known_dirs.add(dirname)
+
+  if not cv2.imwrite(filename, img):
+    raise IOError('cannot write %s' % filename)
+
+  return perf_counter() - t
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import json
+import sqlite3
+import hashlib
+from time import time
+from os import path, makedirs, stat
+
+# -----------------------------------------------------------------------
+# Persistent IQA scores cache, so that an unchanged input file is scored once across runs.
+# Scores are kept in a SQLite file (safe for several worker processes), keyed by the input file identity
+# (path+mtime+size, or its content hash) and by the scorer parameters. Least recently used entries are evicted beyond
+# an entries count, and optionally beyond a file size (the file is then compacted).
+# -----------------------------------------------------------------------
+
+default_iqa_cache_file = path.join(path.expanduser('~'), '.cache', 'tracxpoint_imgenhance', 'iqa_scores.sqlite')
+
+# Bump whenever the scores of a given (file, scorer parameters) may change, e.g. a scorer implementation change:
+iqa_cache_version = 1
+
+# -----------------------------------------------------------------------
+
+def file_digest(filename, chunk_size=2**20):
+  """ SHA-1 of a file content """
+
+  digest = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      digest.update(chunk)
+
+  return digest.hexdigest()
+
+def demosaic_variant(params):
+  """ Scored image variant (see IqaScoreCache.score) of a raw frame demosaiced by the image_enhance demosaic params
+      and narrowed to uint8. The default one (BG, bilinear) keeps the tag it always had, so its scores stay valid """
+
+  suffix = '' if params['demosaic_algorithm'] == 'bilinear' else '_%s' % params['demosaic_algorithm'].upper()
+
+  return 'BAYER_%s2BGR%s_uint8' % (params['demosaic_pattern'], suffix)
+
+# -----------------------------------------------------------------------
+
+class IqaScoreCache(object):
+  """ On-disk IQA scores cache with hit/miss statistics and LRU eviction beyond max_entries, and beyond max_bytes of file
+      size unless None. hash_content=True identifies files by content (robust to copies and touches, but reads every file),
+      otherwise by absolute path, modification time and size """
+
+  schema = 'CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL, file TEXT, last_used REAL)'
+
+  def __init__(self, filename=default_iqa_cache_file, max_entries=100000, hash_content=False, evict_interval=256, max_bytes=None):
+
+    if path.dirname(filename):
+      makedirs(path.dirname(filename), exist_ok=True)
+
+    self.filename = filename
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.hash_content = hash_content
+    self.evict_interval = evict_interval
+    self.hits = self.misses = self.evictions = self.puts = 0
+
+    self.db = sqlite3.connect(filename, timeout=30)
+    with self.db:
+      self.db.execute(self.schema)
+
+  def file_key(self, img_file):
+
+    if self.hash_content:
+      return 'sha1:%s' % file_digest(img_file)
+
+    st = stat(img_file)
+    return 'stat:%s:%d:%d' % (path.abspath(img_file), st.st_mtime_ns, st.st_size)
+
+  def key(self, img_file, **scorer_params):
+    """ Cache key of img_file scored with scorer_params (any JSON-able values, e.g. resize, native, input variant) """
+
+    key = json.dumps([iqa_cache_version, self.file_key(img_file), scorer_params], sort_keys=True)
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+  def get(self, key):
+
+    row = self.db.execute('SELECT score FROM scores WHERE key=?', (key,)).fetchone()
+
+    if row is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    with self.db:
+      self.db.execute('UPDATE scores SET last_used=? WHERE key=?', (time(), key))
+
+    return row[0]
+
+  def put(self, key, score, img_file=''):
+
+    with self.db:
+      self.db.execute('INSERT OR REPLACE INTO scores VALUES (?,?,?,?)', (key, float(score), img_file, time()))
+
+    self.puts += 1
+    if self.puts % self.evict_interval == 0:
+      self.evict()
+
+  def score(self, img_file, load_img, scorer, variant='', **scorer_params):
+    """ Cached scorer(load_img(), **scorer_params), load_img is called on a miss only.
+        variant tags how the scored image is derived from img_file (e.g. demosaic pattern) """
+
+    key = self.key(img_file, scorer='%s.%s' % (scorer.__module__, scorer.__name__), variant=variant, **scorer_params)
+
+    score = self.get(key)
+    if score is None:
+      score = scorer(load_img(), **scorer_params)
+      self.put(key, score, img_file)
+
+    return score
+
+  def evict_lru(self, max_entries):
+    """ Drops the least recently used entries beyond max_entries, returns how many were dropped """
+
+    with self.db:
+      cursor = self.db.execute('DELETE FROM scores WHERE key IN '
+                               '(SELECT key FROM scores ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (max_entries,))
+
+    return cursor.rowcount
+
+  def used_bytes(self):
+    """ Bytes of the database pages in use (the file size, less its free pages) """
+
+    pages = self.db.execute('PRAGMA page_count').fetchone()[0] - self.db.execute('PRAGMA freelist_count').fetchone()[0]
+
+    return pages * self.db.execute('PRAGMA page_size').fetchone()[0]
+
+  def evict(self, max_entries=None, max_bytes=None):
+    """ Drops the least recently used entries beyond max_entries, then, if the file exceeds max_bytes, the ones beyond
+        90% of the entries its used pages can hold (a margin against compacting at every eviction), and compacts it.
+        Returns how many were dropped """
+
+    max_entries = self.max_entries if max_entries is None else max_entries
+    max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+    evicted = self.evict_lru(max_entries)
+
+    if max_bytes is not None and path.getsize(self.filename) > max_bytes:
+      used_bytes = self.used_bytes()
+      if used_bytes > max_bytes:
+        entries = self.db.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+        evicted += self.evict_lru(int(0.9 * entries * max_bytes / used_bytes))
+      self.db.execute('VACUUM')
+
+    self.evictions += evicted
+
+    return evicted
+
+  def clear(self):
+
+    with self.db:
+      self.db.execute('DELETE FROM scores')
+    self.db.execute('VACUUM')
+
+  def stats(self):
+
+    entries = self.db.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+
+    return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries,
+            'file_bytes': path.getsize(self.filename)}
+
+  def close(self):
+
+    self.evict()
+    self.db.close()
+
+# -----------------------------------------------------------------------
+
+def print_iqa_cache_stats(stats):
+
+  lookups = stats['hits'] + stats['misses']
+  print('IQA cache: %d hits, %d misses (%.0f%% hit rate), %d evicted, %d entries, %.1f KB' %
+        (stats['hits'], stats['misses'], 100. * stats['hits'] / lookups if lookups else 0,
+         stats['evictions'], stats['entries'], stats['file_bytes'] / 1024.))
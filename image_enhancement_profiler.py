@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import csv
+import json
+import tracemalloc
+import numpy as np
+from time import perf_counter, process_time
+
+# -----------------------------------------------------------------------
+
+class StageProfiler(object):
+  """ image_enhance instrumentation: per-stage wall time, CPU time (all threads), bytes allocated (tracemalloc peak)
+      and output shape/dtype. Records are plain dictionaries, so they can be pickled across processes and merged.
+      Memory tracing, if not already on, is started for every stage and stopped right after it, so it never slows down
+      the code running outside of the profiler """
+
+  fields = ('frame', 'stage', 'wall', 'cpu', 'alloc_bytes', 'shape', 'dtype')
+
+  def __init__(self, trace_memory=True):
+    self.trace_memory = trace_memory
+    self.records = []
+    self.frame = -1
+
+  def begin_frame(self, frame=None):
+    self.frame = self.frame + 1 if frame is None else frame
+
+  def run(self, stage, func, *args, **kwargs):
+
+    started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+      tracemalloc.start()
+    if self.trace_memory:
+      mem_start = tracemalloc.get_traced_memory()[0]
+      tracemalloc.reset_peak()
+
+    try:
+      wall, cpu = perf_counter(), process_time()
+      res = func(*args, **kwargs)
+      wall, cpu = perf_counter() - wall, process_time() - cpu
+      alloc_bytes = tracemalloc.get_traced_memory()[1] - mem_start if self.trace_memory else 0
+    finally:
+      if started_tracing:
+        tracemalloc.stop()
+
+    self.records.append({'frame': self.frame, 'stage': stage, 'wall': wall, 'cpu': cpu, 'alloc_bytes': alloc_bytes,
+                         'shape': 'x'.join(str(n) for n in res.shape), 'dtype': str(res.dtype)})
+
+    return res
+
+  def last_frame(self):
+    return [r for r in self.records if r['frame'] == self.frame]
+
+# -----------------------------------------------------------------------
+
+class RenderCancelled(Exception):
+  """ Raised by CancellableProfiler when a stage is about to start after cancel() """
+
+class CancellableProfiler(StageProfiler):
+  """ StageProfiler which may be cancelled from another thread: the running stage completes, and the next one
+      raises RenderCancelled, so a stale image_enhance run (e.g. a GUI render) stops between stages.
+      on_stage(stage), if given, is called before every stage (e.g. progress reporting) """
+
+  def __init__(self, trace_memory=False, on_stage=None):
+    StageProfiler.__init__(self, trace_memory)
+    self.cancelled = False
+    self.on_stage = on_stage
+
+  def cancel(self):
+    self.cancelled = True
+
+  def run(self, stage, func, *args, **kwargs):
+    if self.cancelled:
+      raise RenderCancelled(stage)
+    if self.on_stage is not None:
+      self.on_stage(stage)
+    return StageProfiler.run(self, stage, func, *args, **kwargs)
+
+# -----------------------------------------------------------------------
+
+def profile_summary(records, percentiles=(50, 90, 99)):
+  """ Per-stage aggregation of profiler records (stages in order of first appearance): count, mean and percentiles """
+
+  stages = {}
+  for r in records:
+    stages.setdefault(r['stage'], []).append(r)
+
+  summary = []
+  for stage, stage_records in stages.items():
+    row = {'stage': stage, 'count': len(stage_records)}
+    for key in ('wall', 'cpu', 'alloc_bytes'):
+      values = np.array([r[key] for r in stage_records], dtype=np.float64)
+      row['%s_mean' % key] = values.mean()
+      for p in percentiles:
+        row['%s_p%d' % (key, p)] = np.percentile(values, p)
+    summary.append(row)
+
+  return summary
+
+# -----------------------------------------------------------------------
+
+def print_profile_summary(records):
+
+  print('  %-14s %6s %10s %10s %10s %10s %12s' % ('stage', 'count', 'wall_p50', 'wall_p90', 'wall_p99', 'cpu_p50', 'alloc_MB_p50'))
+  for row in profile_summary(records):
+    print('  %-14s %6d %10.4f %10.4f %10.4f %10.4f %12.2f' % (row['stage'], row['count'], row['wall_p50'], row['wall_p90'],
+                                                           row['wall_p99'], row['cpu_p50'], row['alloc_bytes_p50'] / 2.**20))
+
+# -----------------------------------------------------------------------
+
+def write_profile_report(records, filename):
+  """ Writes the raw profiler records, plus their summary for JSON, as CSV or JSON (by the file extension) """
+
+  if filename.endswith('.csv'):
+    fields = list(StageProfiler.fields) + [k for k in (records[0].keys() if records else []) if k not in StageProfiler.fields]
+    with open(filename, 'w', newline='') as f:
+      writer = csv.DictWriter(f, fieldnames=fields)
+      writer.writeheader()
+      writer.writerows(records)
+
+  else:
+    with open(filename, 'w') as f:
+      json.dump({'records': records, 'summary': profile_summary(records)}, f, indent=2)
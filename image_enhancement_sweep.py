@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import itertools
+import numpy as np
+from os import cpu_count
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from image_enhancement import demosaic, gamma_correction, to_bit_depth, quantize, histeq_clahe, denoise, nl_denoise, sharpening, sharpening_kwargs, \
+                              saturation, colorize_bgr, iqa_score_batch, image_enhance_defparams, run_stage
+
+# -----------------------------------------------------------------------
+# Parameters sweep over image_enhance: the requested combinations form a tree of stages, where combinations sharing
+# the parameters of a pipeline prefix share its intermediate images. Every distinct stage output is computed once,
+# the outputs of a given stage (independent branches) are computed in parallel, and they are kept in an LRU cache
+# keyed by the parameters of the prefix, so later sweeps over the same image reuse them as well.
+# -----------------------------------------------------------------------
+
+# image_enhance stages: (name, params keys the stage depends on (or a function of the params returning them),
+#                        disabled(params) predicate or None, function(img, params))
+# A disabled stage passes its input through
+# nl_denoise tile_size/workers are left out on purpose, since tiling does not change its output
+# The demosaic stage only applies to raw (2D) images, see SweepEngine
+# sharpening_mode='lightness' moves the sharpening into the histeq_clahe stage
+sharpening_keys = ('sharpening_mode', 'sharpening_method', 'sharpening_amount', 'sharpening_radius')
+
+sweep_stages = (
+  ('demosaic', ('demosaic_pattern', 'demosaic_algorithm'), None,
+   lambda img, p: demosaic(img, p['demosaic_pattern'], p['demosaic_algorithm'])),
+  ('gamma', ('gamma', 'bit_depth'), None,
+   lambda img, p: to_bit_depth(gamma_correction(img, p['gamma']), p['bit_depth'])),
+  ('histeq_clahe', lambda p: ('clahe_grid', 'clahe_clip_limit') + (sharpening_keys if p['sharpening_mode'] == 'lightness' else ()), None,
+   lambda img, p: histeq_clahe(img, p['clahe_grid'], p['clahe_clip_limit'],
+                               sharpen=sharpening_kwargs(p) if p['sharpening_mode'] == 'lightness' else None)),
+  ('denoise', ('denoise_mode', 'denoise_median_kernel', 'denoise_d', 'denoise_sigmaColor', 'denoise_sigmaSpace'), lambda p: p['denoise_mode'] == 'disabled',
+   lambda img, p: denoise(img, p['denoise_mode'], p['denoise_median_kernel'], p['denoise_d'], p['denoise_sigmaColor'], p['denoise_sigmaSpace'])),
+  ('nl_denoise', ('nl_denoise_h', 'nl_denoise_template_win', 'nl_denoise_search_win'), None,
+   lambda img, p: nl_denoise(img, p['nl_denoise_h'], p['nl_denoise_template_win'], p['nl_denoise_search_win'],
+                             tile_size=p['nl_denoise_tile_size'], workers=p['nl_denoise_workers'])),
+  ('sharpening', sharpening_keys, lambda p: p['sharpening_mode'] != 'enabled',
+   lambda img, p: sharpening(img, **sharpening_kwargs(p))),
+  ('saturation', ('saturation',), None,
+   lambda img, p: saturation(img, p['saturation'])),
+  ('colorize', ('colorize_mode', 'colorize_hue'), lambda p: p['colorize_mode'] == 'disabled',
+   lambda img, p: colorize_bgr(img, p['colorize_hue'])),
+  ('quantize', ('bit_depth',), lambda p: p['bit_depth'] == 8,
+   lambda img, p: quantize(img)),
+)
+
+# -----------------------------------------------------------------------
+
+def stage_key(stage, params):
+  """ Parameters a stage output depends on (a disabled stage depends on nothing) """
+
+  name, keys, disabled = stage[:3]
+
+  if disabled is not None and disabled(params):
+    return (name, 'disabled')
+
+  if callable(keys):
+    keys = keys(params)
+
+  return (name,) + tuple(params[k] for k in keys)
+
+def prefix_keys(params, stages=sweep_stages):
+  """ Cache keys of all the stage outputs of params, the k-th one identifying the pipeline prefix up to stage k """
+
+  keys, prefix = [], ()
+  for stage in stages:
+    prefix += (stage_key(stage, params),)
+    keys.append(prefix)
+
+  return keys
+
+# -----------------------------------------------------------------------
+
+def param_grid(grid, base_params=None):
+  """ All the combinations of grid (params key --> list of values) over base_params (default: image_enhance_defparams) """
+
+  base_params = image_enhance_defparams() if base_params is None else base_params
+  keys = list(grid.keys())
+
+  return [dict(base_params, **dict(zip(keys, values))) for values in itertools.product(*(grid[k] for k in keys))]
+
+# -----------------------------------------------------------------------
+
+class SweepEngine(object):
+  """ Runs image_enhance over many parameters combinations of a single (BGR, or raw to demosaic) image, sharing the
+      common pipeline prefixes. Intermediate images are kept in an LRU cache of up to max_cache_bytes, they must not be modified by the caller """
+
+  def __init__(self, img, workers=0, max_cache_bytes=2**30):
+    self.img = img
+    self.stages = sweep_stages if img.ndim == 2 else sweep_stages[1:]
+    self.workers = workers or cpu_count()
+    self.max_cache_bytes = max_cache_bytes
+    self.cache = OrderedDict()
+    self.cache_bytes = 0
+    self.stage_runs = 0
+    self.cache_hits = 0
+
+  def cache_get(self, key):
+    img = self.cache.get(key)
+    if img is not None:
+      self.cache.move_to_end(key)
+      self.cache_hits += 1
+    return img
+
+  def cache_put(self, key, img):
+    if key in self.cache:
+      return
+    self.cache[key] = img
+    self.cache_bytes += img.nbytes
+    while self.cache_bytes > self.max_cache_bytes and len(self.cache) > 1:
+      self.cache_bytes -= self.cache.popitem(last=False)[1].nbytes
+
+  def plan(self, params):
+    """ Names of the stages run([params]) would compute, i.e. neither cached nor disabled """
+
+    return [stage[0] for stage, key in zip(self.stages, prefix_keys(params, self.stages)) if key[-1][1:] != ('disabled',) and key not in self.cache]
+
+  def run(self, params_list, profiler=None):
+    """ image_enhance outputs of every params in params_list, stage by stage with the distinct outputs of
+        each stage computed in parallel. Combinations with identical outputs share the same image.
+        Computed stages run through the profiler, if given (see image_enhancement_profiler) """
+
+    keys_list = [prefix_keys(params, self.stages) for params in params_list]
+    level = {(): self.img}
+
+    if profiler is not None:
+      profiler.begin_frame()
+
+    with ThreadPoolExecutor(self.workers) as executor:
+      for k, stage in enumerate(self.stages):
+        jobs, next_level = {}, {}
+        for keys, params in zip(keys_list, params_list):
+          key = keys[k]
+          if key in next_level or key in jobs:
+            continue
+          img = level[key[:-1]] if key[-1][1:] == ('disabled',) else self.cache_get(key)
+          if img is not None:
+            next_level[key] = img
+          else:
+            jobs[key] = executor.submit(run_stage, profiler, stage[0], stage[3], level[key[:-1]], params)
+        for key, job in jobs.items():
+          next_level[key] = job.result()
+          self.cache_put(key, next_level[key])
+        self.stage_runs += len(jobs)
+        level = next_level
+
+    return [level[keys[-1]] for keys in keys_list]
+
+  def sweep(self, grid, base_params=None, score=True):
+    """ Runs the param_grid combinations, returns a list of {'params', 'image', 'score'} (score=None without scoring).
+        Each distinct output image is scored once """
+
+    params_list = param_grid(grid, base_params)
+    images = self.run(params_list)
+
+    scores = [None] * len(images)
+    if score:
+      distinct = list({id(img): img for img in images}.values())
+      distinct_scores = dict(zip((id(img) for img in distinct), iqa_score_batch(distinct).tolist()))
+      scores = [distinct_scores[id(img)] for img in images]
+
+    return [{'params': params, 'image': img, 'score': score} for params, img, score in zip(params_list, images, scores)]
+
+  def stats(self):
+    return {'stage_runs': self.stage_runs, 'cache_hits': self.cache_hits, 'cache_entries': len(self.cache),
+            'cache_bytes': self.cache_bytes}
+
+# -----------------------------------------------------------------------
+
+def parse_sweep(text, defparams=None):
+  """ Parses a 'key=v1,v2,...' or 'key=start:stop:step' sweep specification into (key, values), values being
+      cast to the type of the key in image_enhance_defparams """
+
+  defparams = image_enhance_defparams() if defparams is None else defparams
+
+  key, values = text.split('=', 1)
+  if key not in defparams:
+    raise KeyError('unknown image_enhance parameter: %s' % key)
+  cast = type(defparams[key])
+
+  if ':' in values:
+    values = [cast(v) for v in np.arange(*[float(x) for x in values.split(':')])]
+  else:
+    values = [cast(v) for v in values.split(',')]
+
+  return key, values
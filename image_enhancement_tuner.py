@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Created by Shahar Gino at November 2021
+# All rights reserved
+
+import cv2
+import sys
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from os import cpu_count
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from image_enhancement import image_enhance, image_enhance_defparams, iqa_score_batch
+from image_enhancement_io import load_frame
+
+default_data_dir = '/Users/shahargino/data/tracxpoint__data'
+
+# -----------------------------------------------------------------------
+# Automatic tuning of image_enhance parameters, minimizing the mean BRISQUE score (lower=better) over sample frames.
+# Successive halving: many random candidates are evaluated on small downscaled proxies of the frames, and only the
+# best 1/eta of each rung is promoted to the next one, at twice the resolution, up to the full resolution.
+# -----------------------------------------------------------------------
+
+# Searched image_enhance parameters: ('log'/'uniform', low, high), ('int', low, high) or ('choice', values)
+default_search_space = {
+  'gamma': ('log', 1e-4, 1.0),
+  'clahe_grid': ('choice', [4, 8, 16]),
+  'clahe_clip_limit': ('uniform', 1.0, 4.0),
+  'nl_denoise_h': ('int', 0, 30),
+  'sharpening_mode': ('choice', ['enabled', 'lightness', 'disabled']),
+  'saturation': ('uniform', 0.8, 1.5),
+}
+
+# -----------------------------------------------------------------------
+
+def sample_params(space, rng, base_params=None):
+  """ Random image_enhance parameters, space keys drawn over base_params (default: image_enhance_defparams) """
+
+  params = dict(image_enhance_defparams() if base_params is None else base_params)
+
+  for key, (kind, *args) in space.items():
+    if kind == 'log':
+      params[key] = float(np.exp(rng.uniform(np.log(args[0]), np.log(args[1]))))
+    elif kind == 'uniform':
+      params[key] = float(rng.uniform(args[0], args[1]))
+    elif kind == 'int':
+      params[key] = int(rng.integers(args[0], args[1] + 1))
+    elif kind == 'choice':
+      params[key] = args[0][rng.integers(len(args[0]))]
+    else:
+      raise ValueError('Unsupported search space kind: %s' % kind)
+
+  return params
+
+# -----------------------------------------------------------------------
+
+def proxy_frames(frames, scale):
+  """ Frames downscaled by scale (area interpolation, dtype kept) """
+
+  if scale >= 1:
+    return frames
+
+  return [cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) for img in frames]
+
+def evaluate(params, frames):
+  """ Mean BRISQUE score of the enhanced frames (inf if BRISQUE is undefined, e.g. for a flat frame, so it ranks last) """
+
+  return float(np.nan_to_num(np.mean(iqa_score_batch([image_enhance(img, params) for img in frames])), nan=np.inf))
+
+# -----------------------------------------------------------------------
+
+def tune(frames, space=None, candidates=27, eta=3, min_scale=0.25, budget=600., workers=0, seed=0, base_params=None, verbose=True):
+  """ Successive halving over image_enhance parameters on a list of (demosaiced) frames.
+      Rung k evaluates the surviving candidates at min_scale*2**k of the full resolution (the last rung at full
+      resolution), keeping the best 1/eta of them. Candidates are evaluated in parallel threads. When the wall-clock
+      budget (seconds) runs out, the evaluations not started yet are cancelled and the best of the highest completed rung
+      is returned.
+      Returns {'params', 'score', 'scale', 'history'}, history holding every evaluation (those of a rung cut short by the
+      budget flagged 'partial') """
+
+  if not 0 < min_scale <= 1:
+    raise ValueError('Unsupported min_scale: %s (0 < min_scale <= 1)' % min_scale)
+
+  space = default_search_space if space is None else space
+  rng = np.random.default_rng(seed)
+  deadline = perf_counter() + budget
+
+  scales = [min_scale]
+  while scales[-1] < 1:
+    scales.append(min(1., 2 * scales[-1]))
+
+  pool = [sample_params(space, rng, base_params) for _ in range(candidates)]
+  history, best = [], None
+
+  with ThreadPoolExecutor(workers or cpu_count()) as executor:
+    for rung, scale in enumerate(scales):
+      rung_frames = proxy_frames(frames, scale)
+      jobs = [(params, executor.submit(evaluate, params, rung_frames)) for params in pool]
+      for _, job in jobs:
+        wait([job])
+        if perf_counter() > deadline:
+          for _, pending in jobs:
+            pending.cancel()
+      scored = sorted(((job.result(), params) for params, job in jobs if not job.cancelled()), key=lambda x: x[0])
+      partial = len(scored) < len(pool)
+
+      history.extend({'rung': rung, 'scale': scale, 'score': score, 'params': params, 'partial': partial} for score, params in scored)
+
+      if partial:
+        if verbose:
+          print('  rung %d (scale %.3f): budget exhausted after %d/%d candidates' % (rung, scale, len(scored), len(pool)))
+        if best is None and scored:
+          best = {'params': scored[0][1], 'score': scored[0][0], 'scale': scale}
+        break
+
+      best = {'params': scored[0][1], 'score': scored[0][0], 'scale': scale}
+      if verbose:
+        print('  rung %d (scale %.3f): %d candidates, best %.2f, median %.2f' %
+              (rung, scale, len(scored), scored[0][0], scored[len(scored) // 2][0]))
+
+      pool = [params for _, params in scored[:max(1, len(scored) // eta)]]
+
+  if best is not None:
+    best['history'] = history
+
+  return best
+
+# -----------------------------------------------------------------------
+
+def main(argv=None):
+
+  parser = argparse.ArgumentParser(description='Image Enhancement - automatic parameters tuning (min BRISQUE)')
+  parser.add_argument('-i', '--input', default=default_data_dir, help='input directory, scanned recursively')
+  parser.add_argument('--pattern', default='*.tif', help='input files glob pattern')
+  parser.add_argument('--samples', type=int, default=4, help='number of sample frames (evenly spread over the files)')
+  parser.add_argument('--candidates', type=int, default=27, help='number of random candidates of the first rung')
+  parser.add_argument('--eta', type=int, default=3, help='1/eta of the candidates are promoted to the next rung')
+  parser.add_argument('--min-scale', type=float, default=0.25, help='proxies scale of the first rung')
+  parser.add_argument('--budget', type=float, default=600., help='wall-clock budget, in seconds')
+  parser.add_argument('-j', '--workers', type=int, default=0, help='parallel evaluations (default: all cores)')
+  parser.add_argument('--seed', type=int, default=0, help='random seed')
+  parser.add_argument('-o', '--output', default=None, help='save the best parameters into a JSON file')
+  args = parser.parse_args(argv)
+
+  if not 0 < args.min_scale <= 1:
+    parser.error('--min-scale must be within (0, 1]')
+
+  img_files_list = sorted(str(x) for x in Path(args.input).rglob(args.pattern))
+  print('%d images found' % len(img_files_list))
+  if not img_files_list:
+    return 1
+
+  sample_files = [img_files_list[k] for k in np.linspace(0, len(img_files_list) - 1, min(args.samples, len(img_files_list))).astype(int)]
+  frames = [load_frame(f) for f in sample_files]
+
+  defparams = image_enhance_defparams()
+  print('Default parameters: %.2f' % evaluate(defparams, frames))
+
+  t = perf_counter()
+  best = tune(frames, None, args.candidates, args.eta, args.min_scale, args.budget, args.workers, args.seed)
+  if best is None:
+    print('Budget exhausted before any evaluation')
+    return 1
+
+  print('Best: %.2f (scale %.3f), %.1f sec' % (best['score'], best['scale'], perf_counter() - t))
+  for key in default_search_space:
+    print('  %-18s %s' % (key, best['params'][key]))
+
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(best['params'], f, indent=2)
+    print('Parameters saved: %s' % args.output)
+
+  return 0
+
+# -----------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+  sys.exit(main())